@@ -17,6 +17,12 @@ import copy
 import random
 import sys
 import subprocess
+import gzip
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+import multiprocessing
+import shutil
 
 #======Set Stuff=======
 
@@ -25,6 +31,65 @@ STOCK_PTS_PATH = "data/stock_price_trend_history.csv"
 
 EXPORT_RAW_SEC_DEBUG = True   # ← turn OFF to disable entirely
 
+# --- HTTP Record / Replay (SEC + Yahoo) ---
+# "off"    → live network (default)
+# "record" → live network, every SEC / price response saved to the cassette
+# "replay" → zero network, every response served from the cassette
+HTTP_CASSETTE_MODE = os.environ.get("NIDATA_CASSETTE_MODE", "off")
+HTTP_CASSETTE_PATH = os.environ.get("NIDATA_CASSETTE_PATH", "data/http_cassette.json.gz")
+
+# --- Price Provider ---
+# "yahoo" → yf.download (default)
+# "local" → one read of a Parquet/CSV OHLCV file (Date, Ticker, Open, High, Low, Close, Adj Close, Volume)
+#            at LOCAL_PRICE_PATH: bring your own, or build it from Yahoo runs
+#            with LOCAL_PRICE_SAVE on (every fetch is merged into the file)
+PRICE_PROVIDER = os.environ.get("NIDATA_PRICE_PROVIDER", "yahoo")
+LOCAL_PRICE_PATH = os.environ.get("NIDATA_LOCAL_PRICE_PATH", "data/price_history.parquet")
+LOCAL_PRICE_SAVE = os.environ.get("NIDATA_LOCAL_PRICE_SAVE", "0") == "1"   # ← turn ON to keep LOCAL_PRICE_PATH up to date
+
+# --- Incremental Price Cache ---
+# Per-ticker closes + manifest of the last stored bar; fetch_all_prices only
+# requests the missing tail. Bypassed for the local provider and HTTP record/replay.
+PRICE_CACHE_ENABLED = True
+PRICE_CACHE_DIR = "data/price_cache"
+
+# --- Shared Price Panel ---
+# Memory-mapped .npy (ticker-major) + JSON sidecar with the date / ticker indexes.
+# Each save writes a new data/price_panel.<version>.npy; the sidecar
+# (data/price_panel.npy.json) names the version it indexes.
+# Every process that maps it shares one page-cached copy.
+PRICE_PANEL_MMAP_PATH = "data/price_panel.npy"
+
+# --- Yahoo Download Concurrency ---
+PRICE_FETCH_WORKERS = 4            # batches in flight at once
+PRICE_FETCH_MIN_INTERVAL = 0.25    # seconds between request starts (all workers)
+PRICE_FETCH_BATCH_BOUNDS = (5, 100)
+PRICE_FETCH_TARGET_LATENCY = 4.0   # seconds; slower batches shrink the batch size
+
+# --- Regime Stage Sharding ---
+# Sub-industry snapshots / features / classification run per shard of
+# sub-industries in a process pool over the mapped price panel (1 = in-process).
+# Per-shard partitions land in REGIME_SHARD_DIR and are merged, then removed.
+REGIME_SHARD_WORKERS = 4
+REGIME_SHARD_DIR = "data/regime_history/_shards"
+
+# --- Sub-Industry History Backfill ---
+# Fill every missing (date, sub-industry) in the fetched window, not just today.
+# Dates before the 50-day indicators are warm are skipped.
+SUBIND_BACKFILL = True
+SUBIND_BACKFILL_WARMUP_BARS = 51   # SMA_50 / Higher_High_50D need 50 prior bars
+
+# --- Regime History Store ---
+# Append-only Parquet partitions per month (data/regime_history/<name>/YYYY-MM.parquet)
+# plus a _index.json date index; each run only computes and writes new dates.
+REGIME_STORE_DIR = "data/regime_history"
+EXPORT_REGIME_HISTORY_CSV = False   # ← turn ON to also rewrite the full CSV histories each run
+
+# --- Regime Transition Events ---
+# Stores <level>_events (same layout): one row per regime flip, detected on
+# each run's new dates only. Handlers are called with each run's new events.
+REGIME_EVENT_HANDLERS = []   # callables(events: pd.DataFrame), e.g. alerting / rebalance triggers
+
 
 # --- SEC API Configuration ---
 # The SEC requires a User-Agent header for all API requests.
@@ -788,6 +853,185 @@ TECH_RED = [ #late risk watcher
     "Travel and Accomodation",
 ]
 
+# ==========================
+# INDUSTRY REGISTRY
+# ==========================
+# One entry per industry; compute_industry_snapshots runs them all together.
+#   core    - Bear here forces the industry Bear
+#   lead    - core + lead both Bull is the EarlyBull fast-path (optional)
+#   warning - rollover here with reds still bullish is Bear (optional)
+#   green / yellow / red - leadership / confirmation / late-risk tiers
+INDUSTRY_REGISTRY = {
+    "Tech": {
+        "core": TECH_CORE,
+        "lead": "Semiconductors",
+        "warning": TECH_WARNING,
+        "green": TECH_GREEN,
+        "yellow": TECH_YELLOW,
+        "red": TECH_RED,
+    },
+}
+
+# --- Regime codes (RLE persistence / compact history) ---
+REGIME_LABELS = ["Bear", "Neutral", "EarlyBull", "Bull"]     # code = position
+REGIME_CODES = {label: code for code, label in enumerate(REGIME_LABELS)}
+REGIME_MISSING_CODE = -1
+
+REGIME_PERSIST_MIN_RUN = 2   # days a new regime must hold before it persists
+
+# Columns carried as int8 codes / categoricals inside the regime stage
+REGIME_COLUMNS = [
+    "Structural_Regime", "Structural_Regime_Persist", "StockFlow_Regime", "SubIndustry_Regime",
+    "Industry_Regime", "Core_Regime", "Lead_Regime", "Warning_Regime", "Industry_Regime_Persist",
+    "From_Regime", "To_Regime",
+]
+
+# Tech-only industry history columns -> registry names (older stored partitions)
+LEGACY_INDUSTRY_COLUMNS = {
+    "Tech_Regime": "Industry_Regime",
+    "GDT_Regime": "Core_Regime",
+    "Semis_Regime": "Lead_Regime",
+}
+REGIME_ID_COLUMNS = ["Ticker", "SubIndustry", "Industry", "Group"]
+
+# Columns recorded with each regime transition, by level
+REGIME_EVENT_DRIVERS = {
+    "subindustry": [
+        "Structural_Regime_Persist", "StockFlow_Regime",
+        "Pct_Above_SMA_20_5D", "Pct_Above_SMA_50_5D", "New_Low_Ratio_20D_5D",
+        "Pct_Higher_Highs_20D_5D", "Pct_Higher_Highs_50D_5D", "Slope_Median_Pct_From_SMA_20",
+    ],
+    "industry": [
+        "Industry_Regime", "Core_Regime", "Lead_Regime", "Warning_Regime",
+        "Green_Bullish", "Green_Bear", "Yellow_Bullish", "Red_Bullish",
+    ],
+}
+
+# --- Regime Rule Tables ---
+# Mask tables: ordered [(label, [(column, op, threshold), ...])]. Conditions
+# are ANDed, a label may repeat (OR), the first matching rule wins and
+# anything else is Neutral. A label threshold ("Bear") compares regime codes.
+# Lookup tables: {"default": value, "rules": [(first, second, value)]} over a
+# pair of regimes; each side is a label, a list of labels or "*" (anything).
+# Every table is compiled once per run (see load_regime_rules).
+REGIME_RULE_OPS = {
+    ">=": np.greater_equal, ">": np.greater,
+    "<=": np.less_equal, "<": np.less,
+    "==": np.equal, "!=": np.not_equal,
+}
+
+SUBIND_REGIME_REQUIRED_COLS = [
+    "Pct_Above_SMA_20_5D",
+    "Pct_Above_SMA_50_5D",
+    "New_Low_Ratio_20D_5D",
+    "Pct_Higher_Highs_20D_5D",
+    "Pct_Higher_Highs_50D_5D",
+    "Slope_Median_Pct_From_SMA_20",
+]
+
+SUBIND_REGIME_RULES = [
+    ("Bull", [  # Confirmed Bull
+        ("Pct_Above_SMA_20_5D", ">=", 0.65),
+        ("Pct_Above_SMA_50_5D", ">=", 0.55),
+        ("Pct_Higher_Highs_50D_5D", ">=", 0.50),
+        ("Slope_Median_Pct_From_SMA_20", ">=", 0),
+        ("New_Low_Ratio_20D_5D", "<=", 0.15),
+    ]),
+    ("EarlyBull", [  # indicator
+        ("Median_Pct_From_SMA_20", ">", 0),
+        ("Median_Pct_From_SMA_50", ">", 0),
+        ("Pct_Above_SMA_20_5D", ">=", 0.55),
+        ("Pct_Higher_Highs_20D_5D", ">=", 0.40),
+        ("New_Low_Ratio_20D_5D", "<=", 0.25),
+    ]),
+    ("Bear", [  # rollover
+        ("Median_Pct_From_SMA_20", "<", 0),
+        ("Pct_Above_SMA_20_5D", "<", 0.40),
+        ("Pct_Above_SMA_50_5D", "<", 0.35),
+        ("Slope_Median_Pct_From_SMA_20", "<", 0),
+        ("New_Low_Ratio_20D_5D", ">", 0.30),
+    ]),
+]
+
+# Stock-flow: share of core / confirmer names past the PTS cutoffs
+STOCK_FLOW_BULL_PTS = 0.65          # PTS at or above → bullish stock
+STOCK_FLOW_BEAR_PTS = 0.35          # PTS at or below → bearish stock
+
+STOCK_FLOW_RULES = [
+    ("Bear", [("Core_Bear_Pct", ">=", 0.60)]),           # Distribution / Bear
+    ("Bull", [                                           # Confirmed Bull
+        ("Core_Bull_Pct", ">=", 0.40),
+        ("Confirmer_Bull_Pct", ">=", 0.40),
+    ]),
+    ("EarlyBull", [("Core_Bull_Pct", ">=", 0.40)]),      # Early Bull (leaders only)
+]
+
+INDUSTRY_REGIME_RULES = [
+    # BEAR (hard filters)
+    ("Bear", [("Core_Regime", "==", "Bear")]),
+    ("Bear", [("Green_Bear_Pct", ">=", 0.50)]),                                 # Broad breakdown in leadership groups
+    ("Bear", [("Warning_Regime", "==", "Bear"), ("Red_Bullish", ">=", 1)]),     # Warning rollover with reds still bullish
+
+    # EARLY BULL (fast-path)
+    ("EarlyBull", [("Core_Regime", "==", "Bull"), ("Lead_Regime", "==", "Bull")]),
+    ("EarlyBull", [("Core_Regime", "!=", "Bear"), ("Green_Bullish", ">=", 2), ("Warning_Regime", "!=", "Bear")]),
+
+    # CONFIRMED BULL
+    ("Bull", [
+        ("Core_Regime", "!=", "Bear"),
+        ("Green_Bullish", ">=", 3),
+        ("Yellow_Bullish", ">=", 1),
+        ("Warning_Regime", "!=", "Bear"),
+    ]),
+]
+
+# (structural, flow) -> sub-industry regime
+SUBIND_COMBINE_TABLE = {
+    "default": "Neutral",                    # choppy, rotational or inconclusive
+    "rules": [
+        ("Bear", "*", "Bear"),               # risk-first: either side Bear → capital exiting
+        ("*", "Bear", "Bear"),
+        ("Bull", "Bull", "Bull"),            # broad participation + leaders & confirmers
+        (["Bull", "EarlyBull"], "EarlyBull", "EarlyBull"),   # structure improving, leaders working
+    ],
+}
+
+# (industry, sub-industry) -> trend weight (benchmark weight = 1 - trend weight)
+TREND_WEIGHT_TABLE = {
+    "default": 0.30,                         # Industry Bear (any subindustry)
+    "rules": [
+        ("Bull", "Bull", 0.60),
+        ("Bull", "EarlyBull", 0.55),
+        ("Bull", "Neutral", 0.50),
+        ("Neutral", "Bull", 0.45),
+        ("Neutral", "Neutral", 0.40),
+        ("Bull", "Bear", 0.40),
+    ],
+}
+
+REGIME_RULE_TABLES = {
+    "subindustry_structural": SUBIND_REGIME_RULES,
+    "stock_flow": STOCK_FLOW_RULES,
+    "industry": INDUSTRY_REGIME_RULES,
+    "subindustry_combine": SUBIND_COMBINE_TABLE,
+    "trend_weight": TREND_WEIGHT_TABLE,
+}
+
+# Optional JSON {table name: table} replacing built-in tables by name
+REGIME_RULES_PATH = "data/regime_rules.json"
+
+# --- Regime Threshold Calibration ---
+REGIME_CALIBRATION_HORIZON = 20                             # forward bars scored per signal
+REGIME_CALIBRATION_STEPS = (-0.10, -0.05, 0.0, 0.05, 0.10)  # default grid around 0–1 share / PTS thresholds
+
+# Grids for columns on a smaller scale (% from SMA, slope ≈ 1e-3 – 5e-2)
+REGIME_CALIBRATION_COLUMN_STEPS = {
+    "Median_Pct_From_SMA_20": (-0.02, -0.01, 0.0, 0.01, 0.02),
+    "Median_Pct_From_SMA_50": (-0.04, -0.02, 0.0, 0.02, 0.04),
+    "Slope_Median_Pct_From_SMA_20": (-0.01, -0.005, 0.0, 0.005, 0.01),
+}
+REGIME_CALIBRATION_MAX_CELLS = 20_000_000                   # combos × rows per broadcast chunk
+
 #=================================================================
 #
 #
@@ -857,6 +1101,12 @@ TECH_RED = [ #late risk watcher
 # A. flatten_ticker_groups
 # B. load_sec_cik_map
 # C. get_ticker_bucket
+# D. _load_http_cassette
+# E. cassette_lookup
+# F. cassette_store
+# G. save_http_cassette
+# H. _http_get_json
+# I. pipeline_today
 #--------------------------------------------------------------------------
 #
 #
@@ -869,6 +1119,8 @@ SEC_HEADERS = {
 
 _CIK_MAP_CACHE = None
 
+_HTTP_CASSETTE = None
+
 DEFAULT_CV_THRESHOLD = 0.50
 
 CV_THRESHOLDS_BY_METRIC = {
@@ -891,9 +1143,7 @@ def load_sec_cik_map(force_reload: bool = False) -> dict:
         return _CIK_MAP_CACHE
 
     url = "https://www.sec.gov/files/company_tickers.json"
-    r = requests.get(url, headers=SEC_HEADERS, timeout=20)
-    r.raise_for_status()
-    data = r.json()
+    data = _http_get_json(url, headers=SEC_HEADERS)
 
     cik_map = {}
     for entry in data.values():
@@ -925,6 +1175,95 @@ def flatten_ticker_groups(regime_groups: dict) -> list:
         tickers.update(group.get("confirmers", []))
     return sorted(tickers)
 
+
+def _load_http_cassette() -> dict:
+    """
+    Loads the gzipped JSON cassette once per process (empty when absent).
+    """
+    global _HTTP_CASSETTE
+    if _HTTP_CASSETTE is not None:
+        return _HTTP_CASSETTE
+
+    if HTTP_CASSETTE_MODE in ("record", "replay") and os.path.exists(HTTP_CASSETTE_PATH):
+        with gzip.open(HTTP_CASSETTE_PATH, "rt", encoding="utf-8") as f:
+            _HTTP_CASSETTE = json.load(f)
+    else:
+        _HTTP_CASSETTE = {}
+
+    if HTTP_CASSETTE_MODE == "replay":
+        print(f"[INFO] HTTP replay: {len(_HTTP_CASSETTE)} responses from {HTTP_CASSETTE_PATH}")
+    return _HTTP_CASSETTE
+
+
+def cassette_lookup(key: str, default=None):
+    """
+    Returns the recorded response for `key` (replay mode).
+    """
+    cassette = _load_http_cassette()
+    if key not in cassette:
+        print(f"[WARN] HTTP replay miss: {key}")
+        return default
+    return cassette[key]
+
+
+def cassette_store(key: str, value) -> None:
+    """
+    Records a JSON-safe response under `key`. No-op unless recording.
+    """
+    if HTTP_CASSETTE_MODE != "record":
+        return
+    _load_http_cassette()[key] = value
+
+
+def save_http_cassette() -> None:
+    """
+    Writes every recorded response to HTTP_CASSETTE_PATH (record mode only).
+    """
+    if HTTP_CASSETTE_MODE != "record" or _HTTP_CASSETTE is None:
+        return
+
+    os.makedirs(os.path.dirname(HTTP_CASSETTE_PATH) or ".", exist_ok=True)
+    with gzip.open(HTTP_CASSETTE_PATH, "wt", encoding="utf-8") as f:
+        json.dump(_HTTP_CASSETTE, f)
+
+    print(f"[INFO] HTTP cassette saved → {HTTP_CASSETTE_PATH} ({len(_HTTP_CASSETTE)} responses)")
+
+
+def _http_get_json(url: str, headers: dict, timeout: int = 20) -> dict:
+    """
+    requests.get(url).json() routed through the HTTP cassette.
+    Raises on HTTP errors (live) or a missing recording (replay).
+    """
+    key = f"GET {url}"
+
+    if HTTP_CASSETTE_MODE == "replay":
+        data = cassette_lookup(key)
+        if data is None:
+            raise LookupError(f"No recorded response for {url}")
+        return data
+
+    r = requests.get(url, headers=headers, timeout=timeout)
+    r.raise_for_status()
+    data = r.json()
+
+    cassette_store(key, data)
+    return data
+
+
+def pipeline_today() -> datetime:
+    """
+    Run date for price windows. Replay reuses the recorded date so every
+    Yahoo request key matches the recording.
+    """
+    if HTTP_CASSETTE_MODE == "replay":
+        recorded = cassette_lookup("RUN_DATE")
+        if recorded:
+            return datetime.strptime(recorded, "%Y-%m-%d")
+
+    today = datetime.today()
+    cassette_store("RUN_DATE", today.strftime("%Y-%m-%d"))
+    return today
+
 #===============================================================================
 #
 #
@@ -951,6 +1290,11 @@ def _sec_get_json(url: str, sleep_sec: float = 0.2, max_retries: int = 3) -> dic
     """
     SEC-safe GET with basic backoff.
     """
+    key = f"GET {url}"
+
+    if HTTP_CASSETTE_MODE == "replay":
+        return cassette_lookup(key)
+
     for attempt in range(max_retries):
         try:
             r = requests.get(url, headers=SEC_HEADERS, timeout=20)
@@ -959,9 +1303,13 @@ def _sec_get_json(url: str, sleep_sec: float = 0.2, max_retries: int = 3) -> dic
                 continue
             r.raise_for_status()
             time.sleep(sleep_sec)  # polite pacing
-            return r.json()
+            data = r.json()
+            cassette_store(key, data)
+            return data
         except Exception:
             time.sleep(sleep_sec * (2 ** attempt))
+
+    cassette_store(key, None)  # replay the failure too
     return None
 
 
@@ -1035,9 +1383,7 @@ def scrape_sec_financials(
     }
 
     try:
-        r = requests.get(url, headers=headers, timeout=20)
-        r.raise_for_status()
-        data = r.json()
+        data = _http_get_json(url, headers=headers)
     except Exception as e:
         print(f"[WARN] SEC fetch failed for {ticker}: {e}")
         return {}
@@ -1119,7 +1465,8 @@ def scrape_sec_financials(
                 "values": selected_values
             }
 
-    time.sleep(0.12)  # SEC rate-limit friendly
+    if HTTP_CASSETTE_MODE != "replay":
+        time.sleep(0.12)  # SEC rate-limit friendly
     return results
     
     
@@ -1424,7 +1771,10 @@ def safe_get(metric):
 #
 #--------------------------------Function List-------------------------------------
 # A. compute_subindustry_filing_coverage
-# B. count_states
+# B. encode_regimes
+# C. decode_regimes
+# D. encode_regime_frame
+# E. decode_regime_frame
 #-----------------------------------------------------------------------------------
 #
 #-----------------------------------Functions----------------------------------------
@@ -1479,14 +1829,60 @@ def compute_subindustry_filing_coverage(
         "latest_fiscal_period": df["fiscal_period"].max()
     }
 
-def count_states(regimes: list[str]) -> dict:
-    return {
-        "Bull": sum(r == "Bull" for r in regimes),
-        "EarlyBull": sum(r == "EarlyBull" for r in regimes),
-        "Neutral": sum(r == "Neutral" for r in regimes),
-        "Bear": sum(r == "Bear" for r in regimes),
-        "Total": len(regimes),
-    }
+def encode_regimes(regimes) -> np.ndarray:
+    """
+    Regime labels → int8 codes (REGIME_CODES); anything else → REGIME_MISSING_CODE.
+    Numeric input is taken as codes already (NaN → REGIME_MISSING_CODE).
+    """
+    values = np.asarray(regimes)
+
+    if values.dtype.kind in "iub":
+        return values.astype(np.int8)
+    if values.dtype.kind == "f":
+        return np.where(np.isnan(values), REGIME_MISSING_CODE, values).astype(np.int8)
+
+    codes = pd.Categorical(values.ravel(), categories=REGIME_LABELS).codes
+    return codes.astype(np.int8).reshape(values.shape)
+
+
+def decode_regimes(codes) -> np.ndarray:
+    """
+    int8 regime codes → labels; REGIME_MISSING_CODE → NaN.
+    """
+    codes = np.asarray(codes)
+    lookup = np.array(REGIME_LABELS + [np.nan], dtype=object)
+    return lookup[np.where(codes >= 0, codes, len(REGIME_LABELS))]
+
+
+def encode_regime_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    In place: REGIME_COLUMNS → int8 codes, REGIME_ID_COLUMNS → category.
+    Legacy tech-only industry columns are renamed to their registry names.
+    """
+    df.rename(columns=LEGACY_INDUSTRY_COLUMNS, inplace=True)
+    for col in REGIME_COLUMNS:
+        if col in df.columns:
+            df[col] = encode_regimes(df[col])
+    for col in REGIME_ID_COLUMNS:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype("category")
+    return df
+
+
+def decode_regime_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Copy of `df` with regime codes as labels and identifiers as plain strings,
+    for export and for the label-based scoring stage.
+    """
+    df = df.copy()
+    for col in REGIME_COLUMNS:
+        if col in df.columns:
+            df[col] = decode_regimes(encode_regimes(df[col]))
+    for col in REGIME_ID_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype(object)
+    return df
+
    
 #==================================================================================
 #
@@ -1773,8 +2169,24 @@ def compute_hold_ratio(close: pd.Series, window: int) -> float: #For price-trend
 #
 #-----------------------------------Functions List-------------------------------------
 # A. fetch_all_prices
-# B. apply_stock_split_adjustment
-# C. _check_split_ratio
+# B. build_price_panel
+# C. as_price_panel
+# D. select_price_columns
+# E. save_price_panel_mmap
+# F. load_price_panel_mmap
+# G. fetch_prices_yahoo
+# H. _download_yahoo_batch
+# I. _make_rate_limiter
+# J. fetch_prices_local
+# K. load_local_price_history
+# L. save_local_price_history
+# M. fetch_prices_incremental
+# N. load_price_cache_manifest
+# O. save_price_cache_manifest
+# P. apply_stock_split_adjustment
+# Q. _check_split_ratio
+# R. _price_cassette_key
+# S. _replay_price_data
 #------------------------------------------------------------------------------------
 #
 #--------------------------------------Functions--------------------------------------
@@ -1785,96 +2197,55 @@ def fetch_all_prices(
     end_date: str,
     batch_size: int = 25,
     max_retries: int = 3,
-    sleep_seconds: float = 0.5,
-) -> dict:
-
-    import time
-    import yfinance as yf
-    import pandas as pd
+    sleep_seconds: float = PRICE_FETCH_MIN_INTERVAL,
+    provider: str | None = None,
+    use_cache: bool | None = None,
+) -> pd.DataFrame:
+    """
+    Fetches daily closes from the selected price provider (PRICE_PROVIDERS).
+    With the price cache on, only bars after each ticker's last cached bar are requested.
+    Returns the price panel: float64 closes, dates × tickers (see build_price_panel).
+    """
 
     # Ensure valid date order (UNCHANGED)
     if start_date > end_date:
         start_date, end_date = end_date, start_date
 
-    print(f"[DEBUG] Yahoo date range: {start_date} -> {end_date}")
-
     # Deduplicate + stabilize order
     tickers = sorted(set(tickers))
 
-    price_data = {}
-    failed = []
-
-    # 🔴 CHANGED: batched Yahoo calls instead of one giant call
-    for i in range(0, len(tickers), batch_size):
-        batch = tickers[i : i + batch_size]
-
-        for attempt in range(1, max_retries + 1):
-            try:
-                print(
-                    f"[DEBUG] Fetching price batch "
-                    f"{i // batch_size + 1} | "
-                    f"{len(batch)} tickers | attempt {attempt}"
-                )
-
-                df = yf.download(
-                    tickers=batch,
-                    start=start_date,
-                    end=end_date,
-                    interval="1d",
-                    group_by="ticker",
-                    auto_adjust=False,
-                    progress=False,
-                    threads=False,   # 🔴 CRITICAL FIX
-                )
-
-                if df.empty:
-                    raise ValueError("Yahoo returned empty DataFrame")
-
-                # ---- ORIGINAL LOGIC (PRESERVED) ----
-                if isinstance(df.columns, pd.MultiIndex):
-                    for ticker in batch:
-                        if ticker not in df.columns.levels[0]:
-                            continue
-
-                        ticker_df = df[ticker]
-
-                        if "Adj Close" in ticker_df.columns:
-                            s = ticker_df["Adj Close"]
-                        elif "Close" in ticker_df.columns:
-                            s = ticker_df["Close"]
-                        else:
-                            continue
+    provider = provider or PRICE_PROVIDER
+    if provider not in PRICE_PROVIDERS:
+        raise ValueError(f"Unknown price provider: {provider}")
 
-                        s = s.dropna()
-                        if not s.empty:
-                            price_data[ticker] = s.to_frame(name="close")
-
-                else:
-                    # Single-ticker fallback (rare but preserved)
-                    if "Adj Close" in df.columns:
-                        s = df["Adj Close"].dropna()
-                    elif "Close" in df.columns:
-                        s = df["Close"].dropna()
-                    else:
-                        s = None
-
-                    if s is not None and not s.empty:
-                        price_data[batch[0]] = s.to_frame(name="close")
-
-                break  # success → exit retry loop
+    if use_cache is None:
+        use_cache = (
+            PRICE_CACHE_ENABLED and
+            provider != "local" and
+            HTTP_CASSETTE_MODE == "off"
+        )
 
-            except Exception as e:
-                print(f"[WARN] Price batch failed ({attempt}/{max_retries}): {e}")
-                time.sleep(2 ** attempt)
+    provider_kwargs = {
+        "batch_size": batch_size,
+        "max_retries": max_retries,
+        "sleep_seconds": sleep_seconds,
+    }
 
-        else:
-            # All retries failed
-            failed.extend(batch)
+    if use_cache:
+        price_data = fetch_prices_incremental(
+            tickers, start_date, end_date, provider, **provider_kwargs
+        )
+    else:
+        price_data = PRICE_PROVIDERS[provider](
+            tickers, start_date, end_date, **provider_kwargs
+        )
 
-        time.sleep(sleep_seconds)
+    if LOCAL_PRICE_SAVE and provider != "local":
+        save_local_price_history(price_data)
 
     # ---- Sanity check (UNCHANGED STRUCTURE) ----
     print("\n=== SANITY CHECK: PRICE FETCH ===")
+    print(f"Provider: {provider}")
     print(f"Tickers requested: {len(tickers)}")
     print(f"Tickers with price data: {len(price_data)}")
 
@@ -1887,128 +2258,727 @@ def fetch_all_prices(
 
     print("================================\n")
 
-    return price_data
-
-    return price_data
+    return build_price_panel(price_data)
 
 
-def apply_stock_split_adjustment(financial_data: dict) -> dict:
+def build_price_panel(price_data: dict) -> pd.DataFrame:
     """
-    Detects and adjusts historical share counts and closing prices
-    based on stock splits. SEC data is NOT retrospectively adjusted.
+    {ticker: DataFrame(close)} → one contiguous float64 array of closes,
+    dates × tickers, on a shared normalized trading-date index.
+    NaN where a ticker has no bar (pre-IPO, halted, delisted).
     """
+    closes = {
+        ticker: df["close"]
+        for ticker, df in price_data.items()
+        if df is not None and not df.empty
+    }
+    if not closes:
+        return pd.DataFrame(dtype="float64")
 
-    shares_data = financial_data.get("Total Common Shares Outstanding", {})
-    price_data = financial_data.get("Closing Price (USD)", {})
+    wide = pd.concat(closes, axis=1)
 
-    if not shares_data or not price_data:
-        return financial_data
+    index = pd.to_datetime(wide.index)
+    if index.tz is not None:
+        index = index.tz_localize(None)
+    wide.index = index.normalize()
 
-    # Convert and sort years
-    try:
-        years = sorted(int(y) for y in shares_data.keys())
-    except Exception:
-        return financial_data
+    wide = wide[~wide.index.duplicated(keep="last")].sort_index()
+    wide = wide.reindex(columns=sorted(wide.columns))
 
-    split_factors = {}
+    panel = pd.DataFrame(
+        np.ascontiguousarray(wide.to_numpy(dtype="float64")),
+        index=pd.DatetimeIndex(wide.index, name="Date"),
+        columns=pd.Index(wide.columns, name="Ticker"),
+    )
+    return panel
 
-    # --------------------------------------------------
-    # 1) Detect valid splits
-    # --------------------------------------------------
-    for i in range(1, len(years)):
-        y_cur = str(years[i])
-        y_prev = str(years[i - 1])
 
-        try:
-            cur_shares = float(shares_data[y_cur])
-            prev_shares = float(shares_data[y_prev])
-            cur_price = float(price_data.get(y_cur))
-            prev_price = float(price_data.get(y_prev))
-        except Exception:
-            continue
+def as_price_panel(prices) -> pd.DataFrame:
+    """
+    Accepts a price panel or a legacy {ticker: DataFrame(close)} dict.
+    """
+    if isinstance(prices, pd.DataFrame):
+        return prices
+    return build_price_panel(prices or {})
 
-        if prev_shares <= 0 or cur_shares <= 0:
-            continue
 
-        ratio = cur_shares / prev_shares
+def select_price_columns(panel: pd.DataFrame, tickers) -> pd.DataFrame:
+    """
+    The panel's columns for `tickers` (panel order), each one a view onto
+    the panel's array: selecting from the mapped panel copies no prices.
+    """
+    tickers = set(tickers)
+    values = panel.to_numpy()
+    positions = [k for k, t in enumerate(panel.columns) if t in tickers]
+    return pd.DataFrame(
+        {panel.columns[k]: values[:, k] for k in positions},
+        index=panel.index,
+        columns=pd.Index([panel.columns[k] for k in positions], name=panel.columns.name),
+        copy=False
+    )
 
-        # Only consider large jumps
-        if ratio < 1.5:
-            continue
 
-        split_factor = _check_split_ratio(ratio)
-        if split_factor <= 1.0:
-            continue
+def save_price_panel_mmap(panel: pd.DataFrame, path: str = PRICE_PANEL_MMAP_PATH) -> None:
+    """
+    Persists the price panel as a memory-mappable .npy plus `<path>.json`
+    holding the date and ticker indexes.
+    Stored Fortran-order so each ticker's history is one contiguous run.
+    The array goes to a new versioned file and the sidecar naming it is
+    swapped in last, in one os.replace: readers always get an array and
+    indexes from the same save. Older versions are removed afterwards.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    stem = os.path.splitext(path)[0]
+    version = f"{time.time_ns():x}"
+    data_path = f"{stem}.{version}.npy"
+
+    tmp_path = f"{data_path}.tmp.npy"
+    arr = np.lib.format.open_memmap(
+        tmp_path,
+        mode="w+",
+        dtype="float64",
+        shape=panel.shape,
+        fortran_order=True
+    )
+    arr[:] = panel.to_numpy(dtype="float64")
+    arr.flush()
+    del arr
 
-        # --------------------------------------------------
-        # 2) Price sanity check (VERY IMPORTANT)
-        # --------------------------------------------------
-        if prev_price > 0 and cur_price > 0:
-            implied_price_ratio = prev_price / cur_price
+    os.replace(tmp_path, data_path)
 
-            # True split ≈ inverse relationship
-            if abs(implied_price_ratio - split_factor) > 0.6:
-                continue  # reject buybacks / noise
+    meta = {
+        "data": os.path.basename(data_path),
+        "shape": list(panel.shape),
+        "dates": panel.index.strftime("%Y-%m-%d").tolist(),
+        "tickers": [str(t) for t in panel.columns],
+    }
+    with open(f"{path}.json.tmp", "w") as f:
+        json.dump(meta, f)
+    os.replace(f"{path}.json.tmp", f"{path}.json")
 
-        split_factors[y_cur] = split_factor
+    # Readers that already mapped an old version keep its pages until they exit
+    for old in [path, *Path(stem).parent.glob(f"{Path(stem).name}.*.npy")]:
+        if str(old) != data_path and os.path.exists(old):
+            os.remove(old)
 
-    if not split_factors:
-        return financial_data
+    print(f"[SUCCESS] Price panel mapped → {path} ({panel.shape[0]} dates × {panel.shape[1]} tickers)")
 
-    # --------------------------------------------------
-    # 3) Build cumulative adjustment factors
-    # --------------------------------------------------
-    adjustment_by_year = {str(y): 1.0 for y in years}
-    cumulative = 1.0
 
-    for split_year in sorted(split_factors.keys(), key=int, reverse=True):
-        cumulative *= split_factors[split_year]
-        for y in years:
-            if int(y) < int(split_year):
-                adjustment_by_year[str(y)] = cumulative
+def load_price_panel_mmap(path: str = PRICE_PANEL_MMAP_PATH) -> pd.DataFrame:
+    """
+    Maps the persisted price panel read-only. No data is copied: column
+    reads (panel[ticker]) and date slices are views onto the shared pages.
+    A version removed by a concurrent save between reading the sidecar and
+    mapping it is retried against the new sidecar.
+    """
+    for attempt in range(3):
+        with open(f"{path}.json", "r") as f:
+            meta = json.load(f)
+        try:
+            arr = np.load(os.path.join(os.path.dirname(path), meta.get("data", os.path.basename(path))), mmap_mode="r")
+            break
+        except FileNotFoundError:
+            if attempt == 2:
+                raise
+
+    if list(arr.shape) != meta["shape"]:
+        raise ValueError(f"Price panel {path} does not match its sidecar (rewritten mid-read?)")
+
+    return pd.DataFrame(
+        arr,
+        index=pd.DatetimeIndex(pd.to_datetime(meta["dates"]), name="Date"),
+        columns=pd.Index(meta["tickers"], name="Ticker"),
+        copy=False
+    )
 
-    # --------------------------------------------------
-    # 4) Apply adjustments
-    # --------------------------------------------------
-    for metric in [
-        "Total Common Shares Outstanding",
-        "Preferred Stock Issued",
-        "Closing Price (USD)"
-    ]:
-        metric_data = financial_data.get(metric, {})
-        if not metric_data:
-            continue
 
-        for y, factor in adjustment_by_year.items():
-            if factor == 1.0 or y not in metric_data:
-                continue
+def fetch_prices_yahoo(
+    tickers: list,
+    start_date: str,
+    end_date: str,
+    batch_size: int = 25,
+    max_retries: int = 3,
+    sleep_seconds: float = PRICE_FETCH_MIN_INTERVAL,
+    max_workers: int = PRICE_FETCH_WORKERS,
+) -> dict:
+    """
+    Yahoo backend: concurrent, rate-limited yf.download batches → {ticker: DataFrame(close)}.
 
-            try:
-                val = float(metric_data[y])
-            except Exception:
-                continue
+    - Up to `max_workers` batches in flight; request starts spaced by `sleep_seconds`
+    - Batch size adapts (AIMD): grows while batches are fast, halves on slow/failed batches
+    - A failed batch is bisected so one bad symbol cannot fail its neighbours;
+      single tickers are retried up to `max_retries` with backoff
+    - Tickers missing from a good response get one retry on their own
+    """
 
-            if metric in ("Total Common Shares Outstanding", "Preferred Stock Issued"):
-                metric_data[y] = val * factor
-            else:  # Closing Price
-                metric_data[y] = val / factor
+    print(f"[DEBUG] Yahoo date range: {start_date} -> {end_date}")
 
-    return financial_data
+    if HTTP_CASSETTE_MODE == "replay":
+        return _replay_price_data(tickers, start_date, end_date)
 
+    min_batch, max_batch = PRICE_FETCH_BATCH_BOUNDS
+    size = min(max(batch_size, min_batch), max_batch)
 
-def _check_split_ratio(ratio: float) -> float:
-    """
-    Checks if a calculated ratio (new_shares / old_shares) corresponds
-    to a common stock split (e.g., 2:1, 3:1, 4:1).
-    Returns the integer factor or 1.0 if not a real split.
-    """
-    common_splits = [2, 3, 4, 5, 10, 20, 50, 100]
+    acquire = _make_rate_limiter(sleep_seconds)
 
-    for split in common_splits:
-        if abs(ratio - split) < 0.05:
-            return float(split)
+    pending = deque(tickers)
+    retry_batches = deque()      # (batch, attempt, backoff seconds)
+    missing_retried = set()
+    in_flight = {}
 
-    # Reverse splits (rare but possible)
+    price_data = {}
+    failed = []
+    t0 = time.monotonic()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while pending or retry_batches or in_flight:
+
+            while len(in_flight) < max_workers and (retry_batches or pending):
+                if retry_batches:
+                    batch, attempt, backoff = retry_batches.popleft()
+                else:
+                    batch = [pending.popleft() for _ in range(min(size, len(pending)))]
+                    attempt, backoff = 1, 0.0
+
+                future = pool.submit(
+                    _download_yahoo_batch, batch, start_date, end_date, acquire, backoff
+                )
+                in_flight[future] = (batch, attempt)
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                batch, attempt = in_flight.pop(future)
+
+                try:
+                    data, latency = future.result()
+                except Exception as e:
+                    size = max(min_batch, size // 2)
+
+                    if len(batch) > 1:
+                        print(f"[WARN] Price batch of {len(batch)} failed ({e}) → bisecting")
+                        mid = len(batch) // 2
+                        retry_batches.append((batch[:mid], attempt, 0.0))
+                        retry_batches.append((batch[mid:], attempt, 0.0))
+                    elif attempt < max_retries:
+                        retry_batches.append((batch, attempt + 1, float(2 ** attempt)))
+                    else:
+                        print(f"[WARN] {batch[0]} failed after {max_retries} attempts: {e}")
+                        failed.extend(batch)
+                    continue
+
+                price_data.update(data)
+
+                if latency <= PRICE_FETCH_TARGET_LATENCY:
+                    size = min(max_batch, size + min_batch)
+                else:
+                    size = max(min_batch, size // 2)
+
+                # Absent from a good response → likely delisted: one retry, no backoff
+                missing = [t for t in batch if t not in data and t not in missing_retried]
+                if missing and len(batch) > 1:
+                    missing_retried.update(missing)
+                    retry_batches.append((missing, max_retries, 0.0))
+
+    print(
+        f"[DEBUG] Yahoo fetch: {len(price_data)}/{len(tickers)} tickers in "
+        f"{time.monotonic() - t0:.1f}s | final batch size {size} | failed {len(failed)}"
+    )
+
+    for ticker in tickers:
+        cassette_store(
+            _price_cassette_key(ticker, start_date, end_date),
+            {
+                "dates": price_data[ticker].index.strftime("%Y-%m-%d").tolist(),
+                "close": price_data[ticker]["close"].tolist(),
+            } if ticker in price_data else None
+        )
+
+    return price_data
+
+
+def _download_yahoo_batch(
+    batch: list,
+    start_date: str,
+    end_date: str,
+    acquire,
+    backoff: float = 0.0,
+) -> tuple[dict, float]:
+    """
+    One rate-limited yf.download call → ({ticker: DataFrame(close)}, latency).
+    Raises when Yahoo returns nothing for the whole batch.
+    """
+    if backoff > 0:
+        time.sleep(backoff)
+
+    acquire()
+    started = time.monotonic()
+
+    # threads=False: each worker is already one concurrent batch
+    df = yf.download(
+        tickers=batch,
+        start=start_date,
+        end=end_date,
+        interval="1d",
+        group_by="ticker",
+        auto_adjust=False,
+        progress=False,
+        threads=False,
+    )
+    latency = time.monotonic() - started
+
+    if df.empty:
+        raise ValueError("Yahoo returned empty DataFrame")
+
+    price_data = {}
+
+    # ---- ORIGINAL LOGIC (PRESERVED) ----
+    if isinstance(df.columns, pd.MultiIndex):
+        for ticker in batch:
+            if ticker not in df.columns.levels[0]:
+                continue
+
+            ticker_df = df[ticker]
+
+            if "Adj Close" in ticker_df.columns:
+                s = ticker_df["Adj Close"]
+            elif "Close" in ticker_df.columns:
+                s = ticker_df["Close"]
+            else:
+                continue
+
+            s = s.dropna()
+            if not s.empty:
+                price_data[ticker] = s.to_frame(name="close")
+
+    else:
+        # Single-ticker fallback (rare but preserved)
+        if "Adj Close" in df.columns:
+            s = df["Adj Close"].dropna()
+        elif "Close" in df.columns:
+            s = df["Close"].dropna()
+        else:
+            s = None
+
+        if s is not None and not s.empty:
+            price_data[batch[0]] = s.to_frame(name="close")
+
+    if not price_data:
+        raise ValueError("Yahoo returned no closes for batch")
+
+    return price_data, latency
+
+
+def _make_rate_limiter(min_interval: float):
+    """
+    Returns a thread-safe acquire() that spaces call starts by `min_interval`.
+    """
+    lock = threading.Lock()
+    next_start = [0.0]
+
+    def acquire():
+        with lock:
+            now = time.monotonic()
+            delay = next_start[0] - now
+            next_start[0] = max(now, next_start[0]) + min_interval
+        if delay > 0:
+            time.sleep(delay)
+
+    return acquire
+
+
+def fetch_prices_local(
+    tickers: list,
+    start_date: str,
+    end_date: str,
+    path: str | None = None,
+    **_,
+) -> dict:
+    """
+    Local backend: serves closes for the whole universe from one on-disk
+    OHLCV file. Uses Adj Close when present (same as Yahoo backend).
+    """
+    history = load_local_price_history(path or LOCAL_PRICE_PATH)
+
+    print(f"[DEBUG] Local price range: {start_date} -> {end_date}")
+
+    # yf.download treats `end` as exclusive
+    in_range = (
+        (history["Date"] >= pd.Timestamp(start_date)) &
+        (history["Date"] < pd.Timestamp(end_date)) &
+        history["Ticker"].isin(tickers)
+    )
+    px = history.loc[in_range].drop_duplicates(["Date", "Ticker"], keep="last")
+
+    if "Adj Close" in px.columns and "Close" in px.columns:
+        close = px["Adj Close"].fillna(px["Close"])
+    else:
+        close = px["Adj Close"] if "Adj Close" in px.columns else px["Close"]
+
+    wide = (
+        px.assign(close=close)
+        .pivot(index="Date", columns="Ticker", values="close")
+    )
+
+    price_data = {}
+    for ticker in wide.columns:
+        s = wide[ticker].dropna()
+        if not s.empty:
+            price_data[ticker] = s.to_frame(name="close")
+
+    return price_data
+
+
+_LOCAL_PRICE_CACHE = {}
+
+
+def load_local_price_history(path: str) -> pd.DataFrame:
+    """
+    Reads a long-format OHLCV file (.parquet or .csv) once and caches it
+    until the file changes on disk.
+    """
+    mtime = os.path.getmtime(path)
+    cached = _LOCAL_PRICE_CACHE.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    if str(path).endswith(".parquet"):
+        history = pd.read_parquet(path)
+    else:
+        history = pd.read_csv(path)
+
+    missing = {"Date", "Ticker"} - set(history.columns)
+    if missing or not ({"Adj Close", "Close"} & set(history.columns)):
+        raise ValueError(f"Local price file {path} needs Date, Ticker and Close/Adj Close columns")
+
+    history["Date"] = pd.to_datetime(history["Date"]).dt.normalize()
+    history["Ticker"] = history["Ticker"].astype(str).str.upper()
+
+    _LOCAL_PRICE_CACHE[path] = (mtime, history)
+    print(f"[INFO] Local prices loaded: {history['Ticker'].nunique()} tickers from {path}")
+    return history
+
+
+def save_local_price_history(price_data: dict, path: str | None = None) -> None:
+    """
+    Merges fetched closes into the local price file so later runs can use
+    PRICE_PROVIDER = "local". Existing (Date, Ticker) rows are replaced.
+    """
+    path = path or LOCAL_PRICE_PATH
+
+    frames = [
+        pd.DataFrame({
+            "Date": pd.to_datetime(df.index).normalize(),
+            "Ticker": ticker,
+            "Adj Close": df["close"].values,
+        })
+        for ticker, df in price_data.items()
+        if not df.empty
+    ]
+    if not frames:
+        return
+
+    new = pd.concat(frames, ignore_index=True)
+    if os.path.exists(path):
+        new = pd.concat([load_local_price_history(path), new], ignore_index=True)
+
+    new = (
+        new
+        .drop_duplicates(["Date", "Ticker"], keep="last")
+        .sort_values(["Ticker", "Date"])
+        .reset_index(drop=True)
+    )
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    if str(path).endswith(".parquet"):
+        new.to_parquet(path, index=False)
+    else:
+        new.to_csv(path, index=False)
+
+    print(f"[SUCCESS] Local price history saved → {path}")
+
+
+def _price_cassette_key(ticker: str, start_date: str, end_date: str) -> str:
+    return f"YAHOO {ticker} {start_date} {end_date}"
+
+
+def _replay_price_data(tickers: list, start_date: str, end_date: str) -> dict:
+    """
+    Rebuilds fetch_all_prices output from recorded per-ticker closes.
+    """
+    price_data = {}
+    for ticker in tickers:
+        rec = cassette_lookup(_price_cassette_key(ticker, start_date, end_date))
+        if not rec:
+            continue
+        price_data[ticker] = pd.DataFrame(
+            {"close": rec["close"]},
+            index=pd.to_datetime(rec["dates"])
+        )
+    return price_data
+
+
+PRICE_PROVIDERS = {
+    "yahoo": fetch_prices_yahoo,
+    "local": fetch_prices_local,
+}
+
+
+def fetch_prices_incremental(
+    tickers: list,
+    start_date: str,
+    end_date: str,
+    provider: str,
+    **provider_kwargs,
+) -> dict:
+    """
+    Serves [start_date, end_date) from the per-ticker price cache and asks the
+    provider only for what is missing:
+      - covered tickers → tail from the last cached bar (re-fetched, since it
+        may have been an intraday bar)
+      - new / under-covered tickers → full range
+      - tickers whose re-fetched last bar moved (adjusted closes restated after
+        a dividend / split) → full range, replacing the cached history
+    Merges are idempotent: one row per date, newest download wins.
+    """
+    manifest = load_price_cache_manifest()
+
+    # fetch_start → tickers sharing that request range
+    requests_by_start = {}
+    for ticker in tickers:
+        entry = manifest.get(ticker)
+        if entry and entry["from"] <= start_date:
+            if entry["last"] >= end_date:
+                continue
+            fetch_start = entry["last"]
+        else:
+            fetch_start = start_date
+        requests_by_start.setdefault(fetch_start, []).append(ticker)
+
+    n_full = len(requests_by_start.get(start_date, []))
+    n_tail = sum(len(v) for v in requests_by_start.values()) - n_full
+    print(
+        f"[DEBUG] Price cache: {len(tickers) - n_full - n_tail} current | "
+        f"{n_tail} tail fetches | {n_full} full fetches"
+    )
+
+    fetched = {}
+    for fetch_start, group in sorted(requests_by_start.items()):
+        fetched.update(
+            PRICE_PROVIDERS[provider](group, fetch_start, end_date, **provider_kwargs)
+        )
+
+    os.makedirs(PRICE_CACHE_DIR, exist_ok=True)
+
+    cached_frames = {}
+    restated = []
+    for ticker in tickers:
+        path = os.path.join(PRICE_CACHE_DIR, f"{ticker}.csv")
+        if ticker not in manifest or not os.path.exists(path):
+            continue
+        cached = pd.read_csv(path, index_col="Date", parse_dates=["Date"], float_precision="round_trip")
+        cached_frames[ticker] = cached
+
+        new = fetched.get(ticker)
+        last = pd.Timestamp(manifest[ticker]["last"])
+        if (
+            new is not None and last in cached.index and
+            last in pd.to_datetime(new.index).normalize()
+        ):
+            old_close = cached.at[last, "close"]
+            new_close = new["close"].to_numpy()[pd.to_datetime(new.index).normalize() == last][-1]
+            if not np.isclose(old_close, new_close, rtol=1e-6, atol=0):
+                restated.append(ticker)
+
+    replaced = set()
+    if restated:
+        print(f"[DEBUG] Price cache: {len(restated)} tickers restated → full re-fetch")
+        refetched = PRICE_PROVIDERS[provider](restated, start_date, end_date, **provider_kwargs)
+        for ticker in restated:
+            full = refetched.get(ticker)
+            if full is not None and not full.empty:
+                fetched[ticker] = full
+                cached_frames.pop(ticker, None)
+                replaced.add(ticker)
+            else:
+                # Keep the cached history rather than joining the restated tail
+                # onto it; the next run detects the restatement again
+                fetched.pop(ticker, None)
+                print(f"[WARN] Price cache: re-fetch failed for restated {ticker} → kept cached history")
+
+    price_data = {}
+    for ticker in tickers:
+        path = os.path.join(PRICE_CACHE_DIR, f"{ticker}.csv")
+        cached = cached_frames.get(ticker)
+
+        new = fetched.get(ticker)
+        if new is not None and not new.empty:
+            new = new[["close"]].copy()
+            new.index = pd.to_datetime(new.index).normalize()
+            new.index.name = "Date"
+
+            merged = new if cached is None else pd.concat([cached, new])
+            merged = merged[~merged.index.duplicated(keep="last")].sort_index()
+            merged.to_csv(path)
+
+            entry = manifest.get(ticker, {})
+            manifest[ticker] = {
+                "from": (
+                    start_date if ticker in replaced
+                    else min(entry.get("from", start_date), start_date)
+                ),
+                "first": merged.index[0].strftime("%Y-%m-%d"),
+                "last": merged.index[-1].strftime("%Y-%m-%d"),
+            }
+        else:
+            merged = cached
+
+        if merged is None:
+            continue
+
+        window = merged.loc[
+            (merged.index >= pd.Timestamp(start_date)) &
+            (merged.index < pd.Timestamp(end_date))
+        ]
+        if not window.empty:
+            price_data[ticker] = window
+
+    save_price_cache_manifest(manifest)
+    return price_data
+
+
+def load_price_cache_manifest() -> dict:
+    path = os.path.join(PRICE_CACHE_DIR, "_manifest.json")
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def save_price_cache_manifest(manifest: dict):
+    os.makedirs(PRICE_CACHE_DIR, exist_ok=True)
+    with open(os.path.join(PRICE_CACHE_DIR, "_manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+
+def apply_stock_split_adjustment(financial_data: dict) -> dict:
+    """
+    Detects and adjusts historical share counts and closing prices
+    based on stock splits. SEC data is NOT retrospectively adjusted.
+    """
+
+    shares_data = financial_data.get("Total Common Shares Outstanding", {})
+    price_data = financial_data.get("Closing Price (USD)", {})
+
+    if not shares_data or not price_data:
+        return financial_data
+
+    # Convert and sort years
+    try:
+        years = sorted(int(y) for y in shares_data.keys())
+    except Exception:
+        return financial_data
+
+    split_factors = {}
+
+    # --------------------------------------------------
+    # 1) Detect valid splits
+    # --------------------------------------------------
+    for i in range(1, len(years)):
+        y_cur = str(years[i])
+        y_prev = str(years[i - 1])
+
+        try:
+            cur_shares = float(shares_data[y_cur])
+            prev_shares = float(shares_data[y_prev])
+            cur_price = float(price_data.get(y_cur))
+            prev_price = float(price_data.get(y_prev))
+        except Exception:
+            continue
+
+        if prev_shares <= 0 or cur_shares <= 0:
+            continue
+
+        ratio = cur_shares / prev_shares
+
+        # Only consider large jumps
+        if ratio < 1.5:
+            continue
+
+        split_factor = _check_split_ratio(ratio)
+        if split_factor <= 1.0:
+            continue
+
+        # --------------------------------------------------
+        # 2) Price sanity check (VERY IMPORTANT)
+        # --------------------------------------------------
+        if prev_price > 0 and cur_price > 0:
+            implied_price_ratio = prev_price / cur_price
+
+            # True split ≈ inverse relationship
+            if abs(implied_price_ratio - split_factor) > 0.6:
+                continue  # reject buybacks / noise
+
+        split_factors[y_cur] = split_factor
+
+    if not split_factors:
+        return financial_data
+
+    # --------------------------------------------------
+    # 3) Build cumulative adjustment factors
+    # --------------------------------------------------
+    adjustment_by_year = {str(y): 1.0 for y in years}
+    cumulative = 1.0
+
+    for split_year in sorted(split_factors.keys(), key=int, reverse=True):
+        cumulative *= split_factors[split_year]
+        for y in years:
+            if int(y) < int(split_year):
+                adjustment_by_year[str(y)] = cumulative
+
+    # --------------------------------------------------
+    # 4) Apply adjustments
+    # --------------------------------------------------
+    for metric in [
+        "Total Common Shares Outstanding",
+        "Preferred Stock Issued",
+        "Closing Price (USD)"
+    ]:
+        metric_data = financial_data.get(metric, {})
+        if not metric_data:
+            continue
+
+        for y, factor in adjustment_by_year.items():
+            if factor == 1.0 or y not in metric_data:
+                continue
+
+            try:
+                val = float(metric_data[y])
+            except Exception:
+                continue
+
+            if metric in ("Total Common Shares Outstanding", "Preferred Stock Issued"):
+                metric_data[y] = val * factor
+            else:  # Closing Price
+                metric_data[y] = val / factor
+
+    return financial_data
+
+
+def _check_split_ratio(ratio: float) -> float:
+    """
+    Checks if a calculated ratio (new_shares / old_shares) corresponds
+    to a common stock split (e.g., 2:1, 3:1, 4:1).
+    Returns the integer factor or 1.0 if not a real split.
+    """
+    common_splits = [2, 3, 4, 5, 10, 20, 50, 100]
+
+    for split in common_splits:
+        if abs(ratio - split) < 0.05:
+            return float(split)
+
+    # Reverse splits (rare but possible)
     reverse_splits = [0.5, 0.333, 0.25, 0.2, 0.1, 0.01]
     for split in reverse_splits:
         if abs(ratio - split) < 0.05:
@@ -2030,21 +3000,37 @@ def _check_split_ratio(ratio: float) -> float:
 #
 #-----------------------------------Functions List-------------------------------------
 # A. build_daily_stock_pts
-# B. build_price_features
-# C. score_stock_price_trend
-# D. compute_sma
-# E. percent_from_sma
-# F. compute_nd
-# G. compute_ma_stack
-# H. _slope
-# I. is_higher_high
-# J. is_new_low
-# K. compute_new_low_penalty
+# B. build_stock_pts_history
+# C. build_pts_component_panel
+# D. save_stock_pts_history
+# E. build_price_features
+# F. build_price_feature_panel
+# G. reset_price_feature_cache
+# H. compute_price_indicator_panel
+# I. get_price_indicators
+# J. _interior_gap_columns
+# K. score_stock_price_trend
+# L. compute_pts_components_from_tail
+# M. init_indicator_state
+# N. _push_monotonic
+# O. update_indicator_state
+# P. advance_indicator_states
+# Q. prime_price_feature_cache
+# R. load_indicator_states
+# S. save_indicator_states
+# T. compute_sma
+# U. percent_from_sma
+# V. compute_nd
+# W. compute_ma_stack
+# X. compute_rolling_slope
+# Y. is_higher_high
+# Z. is_new_low
+# AA. compute_new_low_penalty
 #------------------------------------------------------------------------------------
 #
 #--------------------------------------Functions--------------------------------------
 def build_daily_stock_pts(
-    price_data: dict,
+    price_panel: pd.DataFrame,
     asof_date: pd.Timestamp,
     ticker_to_subindustry: dict,
     fair_value_scores: dict | None = None
@@ -2052,15 +3038,21 @@ def build_daily_stock_pts(
     """
     Builds daily stock Price-Trend Scores (PTS).
     Price + valuation only. NO regime logic.
+    Components come from the per-run feature cache when present
+    (streamed / already computed), else from the trailing window.
     """
 
     rows = []
     date_str = asof_date.strftime("%Y-%m-%d")
 
-    for ticker, df in price_data.items():
+    panel = as_price_panel(price_panel)
+    if panel.empty or asof_date not in panel.index:
+        return pd.DataFrame(rows)
 
-        if df.empty or asof_date not in df.index:
-            continue
+    history = panel.loc[:asof_date]
+    traded_today = history.iloc[-1].notna()
+
+    for ticker in panel.columns[traded_today.to_numpy()]:
 
         if ticker not in ticker_to_subindustry:
             continue
@@ -2068,7 +3060,13 @@ def build_daily_stock_pts(
         subindustry = ticker_to_subindustry[ticker]
 
         # --- Price trend score ---
-        pts, components = score_stock_price_trend(df, asof_date)
+        cached = _PRICE_FEATURE_CACHE.setdefault((ticker, date_str), {})
+        if "PTS" not in cached:
+            pts, components = score_stock_price_trend(history[ticker], asof_date)
+            cached.update(components, PTS=pts)
+
+        pts = cached["PTS"]
+        components = {k: cached[k] for k in PTS_COMPONENT_KEYS}
 
         # --- Benchmark / Fair Value score ---
         fair_value_score = (
@@ -2088,15 +3086,145 @@ def build_daily_stock_pts(
             **components
         })
 
-    return pd.DataFrame(rows)
+    return encode_regime_frame(pd.DataFrame(rows))
+
+
+def build_stock_pts_history(
+    price_panel: pd.DataFrame,
+    start_date: pd.Timestamp,
+    end_date: pd.Timestamp,
+    ticker_to_subindustry: dict,
+    fair_value_scores: dict | None = None
+) -> pd.DataFrame:
+    """
+    Range mode of build_daily_stock_pts: PTS + components for every ticker on
+    every panel date in [start_date, end_date], from one vectorized pass.
+    Same columns and values as calling build_daily_stock_pts per date.
+    """
+    panel = as_price_panel(price_panel)
+    tickers = [t for t in panel.columns if t in ticker_to_subindustry]
+    if panel.empty or not tickers:
+        return pd.DataFrame()
+
+    components = {
+        name: frame[tickers]
+        for name, frame in compute_price_indicator_panel(panel).items()
+    }
+    panel = panel[tickers]
+
+    in_range = (panel.index >= pd.Timestamp(start_date)) & (panel.index <= pd.Timestamp(end_date))
+    traded = panel.notna().to_numpy() & in_range[:, None]
+    date_idx, ticker_idx = np.nonzero(traded)
+
+    dates = panel.index[date_idx]
+    ticker_arr = panel.columns.to_numpy()[ticker_idx]
+
+    out = pd.DataFrame({
+        "Date": dates.strftime("%Y-%m-%d"),
+        "Ticker": pd.Categorical.from_codes(ticker_idx, categories=panel.columns),
+        "SubIndustry": pd.Categorical([ticker_to_subindustry[t] for t in panel.columns])[ticker_idx],
+
+        # Raw scores ONLY
+        "PTS": components["PTS"].to_numpy()[date_idx, ticker_idx],
+        "Fair_Value_Score": (
+            [fair_value_scores.get(t, np.nan) for t in ticker_arr]
+            if fair_value_scores else np.nan
+        ),
+    })
+
+    for name in ["ND20", "ND50", "MA_Stack", "Hold50", "LowPenalty", "Return_50D"]:
+        out[name] = components[name].to_numpy()[date_idx, ticker_idx]
+
+    return out
+
+
+def build_pts_component_panel(
+    price_panel: pd.DataFrame,
+    features: dict | None = None
+) -> dict[str, pd.DataFrame]:
+    """
+    score_stock_price_trend for every ticker and date at once.
+    Returns {component: DataFrame(dates × tickers)} incl. 'PTS'.
+    Columns with interior gaps are evaluated on their own bars.
+    `features` (build_price_feature_panel of the same panel) reuses its SMAs / lows.
+    """
+    close = as_price_panel(price_panel)
+    traded = close.notna()
+
+    if features is not None:
+        sma20, sma50, new_low_20 = features["SMA_20"], features["SMA_50"], features["New_Low_20D"]
+    else:
+        sma20, sma50, new_low_20 = compute_sma(close, 20), compute_sma(close, 50), is_new_low(close, 20)
+
+    comps = {
+        "ND20": close / close.rolling(20).max() - 1,
+        "ND50": close / close.rolling(50).max() - 1,
+        "MA_Stack": ((close > sma20) & (sma20 > sma50)).astype("float64"),
+        # Share of the last 50 / 20 own bars → NaN rows are skipped by the mean
+        "Hold50": (close > sma50).astype("float64").where(traded).rolling(50, min_periods=1).mean(),
+        "LowPenalty": new_low_20.astype("float64").where(traded).rolling(20, min_periods=1).mean(),
+        "Return_50D": close / close.shift(50) - 1,
+    }
+
+    for ticker in _interior_gap_columns(close):
+        own = build_pts_component_panel(close[[ticker]].dropna())
+        for name in comps:
+            comps[name][ticker] = own[name][ticker].reindex(close.index)
+
+    pts = (
+        0.20 * comps["ND20"].fillna(0) +
+        0.25 * comps["ND50"].fillna(0) +
+        0.20 * comps["MA_Stack"] +
+        0.20 * comps["Hold50"] -
+        0.15 * comps["LowPenalty"]
+    )
+    comps["PTS"] = pts.clip(0, 1)
+
+    return comps
+
+
+def save_stock_pts_history(
+    pts_history: pd.DataFrame,
+    path: str = STOCK_PTS_PATH
+) -> pd.DataFrame:
+    """
+    Merges PTS rows into the stock PTS history CSV.
+    Idempotent: one row per (Date, Ticker), newest wins.
+    """
+    if pts_history is None or pts_history.empty:
+        return pts_history
+
+    if os.path.exists(path):
+        existing = pd.read_csv(path)
+        merged = pd.concat([existing, pts_history], ignore_index=True)
+    else:
+        merged = pts_history
+
+    merged["Date"] = pd.to_datetime(merged["Date"]).dt.strftime("%Y-%m-%d")
+    merged = (
+        merged
+        .drop_duplicates(["Date", "Ticker"], keep="last")
+        .sort_values(["Date", "Ticker"])
+        .reset_index(drop=True)
+    )
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    merged.to_csv(path, index=False)
+    print(f"[SUCCESS] Stock PTS history saved → {path} ({len(pts_history)} rows updated)")
+
+    return merged
 
 
 def build_price_features(df):
     """
     df must contain a 'close' column indexed by date
+    (a close Series / price-panel column is also accepted)
     """
 
-    df = df.copy()
+    if isinstance(df, pd.Series):
+        df = df.to_frame(name="close")
+    else:
+        df = df.copy()
 
     # Moving Averages
     df["SMA_20"] = compute_sma(df["close"], 20)
@@ -2117,53 +3245,420 @@ def build_price_features(df):
     return df
 
 
+def build_price_feature_panel(price_panel: pd.DataFrame) -> dict[str, pd.DataFrame]:
+    """
+    build_price_features for every ticker at once.
+    Returns {feature: DataFrame(dates × tickers)} with the same columns as
+    build_price_features ('close', SMA_20, ..., Higher_High_50D).
+
+    Each indicator is one 2-D rolling pass over the panel. Leading / trailing
+    NaNs (listing, delisting) give the same values as the per-ticker path;
+    columns with interior gaps are recomputed on their own bars so results
+    stay identical. Rows where a ticker has no close are NaN / False.
+    """
+    close = as_price_panel(price_panel)
+
+    features = {"close": close}
+
+    features["SMA_20"] = compute_sma(close, 20)
+    features["SMA_50"] = compute_sma(close, 50)
+
+    features["Pct_From_SMA_20"] = percent_from_sma(close, features["SMA_20"])
+    features["Pct_From_SMA_50"] = percent_from_sma(close, features["SMA_50"])
+
+    features["New_Low_20D"] = is_new_low(close, 20)
+    features["New_Low_50D"] = is_new_low(close, 50)
+
+    features["Higher_High_20D"] = is_higher_high(close, 20)
+    features["Higher_High_50D"] = is_higher_high(close, 50)
+
+    gap_cols = _interior_gap_columns(close)
+    if gap_cols:
+        features = {name: frame.copy() for name, frame in features.items()}
+        for ticker in gap_cols:
+            s = close[ticker].dropna()
+            per_ticker = build_price_features(s).reindex(close.index)
+            for name, frame in features.items():
+                if name == "close":
+                    continue
+                col = per_ticker[name]
+                if frame[ticker].dtype == bool:
+                    col = col.fillna(False).astype(bool)
+                frame[ticker] = col
+
+    return features
+
+
+# --- Per-run price feature cache ---
+# (ticker, "YYYY-MM-DD") → {price feature / PTS component: value}
+# Filled from streamed state, tail scoring or the universe-wide panels, so each
+# ticker's indicators are computed once per run whichever stage asks first.
+PRICE_FEATURE_KEYS = [
+    "close", "SMA_20", "SMA_50", "Pct_From_SMA_20", "Pct_From_SMA_50",
+    "New_Low_20D", "New_Low_50D", "Higher_High_20D", "Higher_High_50D",
+]
+PTS_COMPONENT_KEYS = ["ND20", "ND50", "MA_Stack", "Hold50", "LowPenalty", "Return_50D"]
+
+_PRICE_FEATURE_CACHE = {}
+_PRICE_INDICATOR_PANEL = None    # (price panel, {name: DataFrame}) for the current run
+
+
+def reset_price_feature_cache() -> None:
+    global _PRICE_INDICATOR_PANEL
+    _PRICE_FEATURE_CACHE.clear()
+    _PRICE_INDICATOR_PANEL = None
+
+
+def compute_price_indicator_panel(price_panel: pd.DataFrame) -> dict[str, pd.DataFrame]:
+    """
+    Price features + PTS components (+ PTS) for the whole panel, computed once
+    per run and memoized on the panel object.
+    """
+    global _PRICE_INDICATOR_PANEL
+    if _PRICE_INDICATOR_PANEL is not None and _PRICE_INDICATOR_PANEL[0] is price_panel:
+        return _PRICE_INDICATOR_PANEL[1]
+
+    features = build_price_feature_panel(price_panel)
+    frames = {
+        **features,
+        **build_pts_component_panel(price_panel, features=features),
+    }
+
+    _PRICE_INDICATOR_PANEL = (price_panel, frames)
+    return frames
+
+
+def get_price_indicators(
+    ticker: str,
+    asof_date: pd.Timestamp,
+    price_panel: pd.DataFrame
+) -> dict | None:
+    """
+    Memoized indicators for (ticker, asof_date); None if no bar that day.
+    Cache misses are served from the run's universe-wide indicator panels.
+    """
+    key = (ticker, asof_date.strftime("%Y-%m-%d"))
+    entry = _PRICE_FEATURE_CACHE.get(key)
+    if entry is not None and all(k in entry for k in PRICE_FEATURE_KEYS):
+        return entry
+
+    frames = compute_price_indicator_panel(price_panel)
+    close = frames["close"]
+    if ticker not in close.columns or asof_date not in close.index or pd.isna(close.at[asof_date, ticker]):
+        return None
+
+    entry = _PRICE_FEATURE_CACHE.setdefault(key, {})
+    for name, frame in frames.items():
+        entry.setdefault(name, frame.at[asof_date, ticker])
+    return entry
+
+
+def _interior_gap_columns(price_panel: pd.DataFrame) -> list:
+    """
+    Tickers with a missing bar between their first and last close.
+    """
+    valid = price_panel.notna().to_numpy()
+    if valid.size == 0:
+        return []
+
+    n = valid.shape[0]
+    has_any = valid.any(axis=0)
+    first = valid.argmax(axis=0)
+    last = n - 1 - valid[::-1].argmax(axis=0)
+    span = last - first + 1
+
+    gaps = has_any & (valid.sum(axis=0) != span)
+    return list(price_panel.columns[gaps])
+
+
+# Longest look-back any PTS component needs: Hold50 averages the last 50
+# (close > SMA_50) flags and the oldest of those SMA_50s spans 50 more bars.
+PTS_TAIL_BARS = 99
+
+
 def score_stock_price_trend(
     df: pd.DataFrame,
     asof_date: pd.Timestamp
 ):
     """
     Computes full Price-Trend Score (PTS) and components.
-    """
-
-    df_slice = df.loc[:asof_date].copy()
+    `df` is a close Series (price-panel column) or a DataFrame with 'close'.
 
-    if "close" not in df_slice.columns:
-        raise ValueError("Expected 'close' column in price data")
+    Only the trailing PTS_TAIL_BARS closes up to `asof_date` are read, so the
+    cost per ticker per date is constant however much history is loaded.
+    """
 
-    # 🔴 Build indicators FIRST
-    df_feat = build_price_features(df_slice)
+    if isinstance(df, pd.DataFrame):
+        if "close" not in df.columns:
+            raise ValueError("Expected 'close' column in price data")
+        close = df["close"]
+    else:
+        close = df
 
-    close = df_feat["close"]
+    end = close.index.searchsorted(asof_date, side="right")
+    tail = close.iloc[max(0, end - PTS_TAIL_BARS):end].to_numpy(dtype="float64")
 
-    # --- Core metrics ---
-    nd20 = compute_nd(close, 20)
-    nd50 = compute_nd(close, 50)
+    if np.isnan(tail).any():
+        # Gaps inside the window: use this ticker's own last bars
+        tail = close.iloc[:end].dropna().to_numpy(dtype="float64")[-PTS_TAIL_BARS:]
 
-    ma_stack = compute_ma_stack(df_feat)
-    hold_50 = compute_hold_ratio(close, 50)
-    low_penalty = compute_new_low_penalty(close, 20)
+    components = compute_pts_components_from_tail(tail)
 
     # --- Weighted base score ---
     pts_base = (
-        0.20 * np.nan_to_num(nd20) +
-        0.25 * np.nan_to_num(nd50) +
-        0.20 * ma_stack +
-        0.20 * hold_50 -
-        0.15 * low_penalty
+        0.20 * np.nan_to_num(components["ND20"]) +
+        0.25 * np.nan_to_num(components["ND50"]) +
+        0.20 * components["MA_Stack"] +
+        0.20 * components["Hold50"] -
+        0.15 * components["LowPenalty"]
     )
 
     pts_base = np.clip(pts_base, 0, 1)
 
-    components = {
+    return pts_base, components
+
+
+def compute_pts_components_from_tail(close: np.ndarray) -> dict:
+    """
+    PTS components from the trailing closes (oldest → newest, no NaNs).
+    Same definitions as compute_nd / compute_ma_stack / compute_hold_ratio /
+    compute_new_low_penalty on the full series.
+    """
+    n = len(close)
+    if n == 0:
+        return {
+            "ND20": np.nan, "ND50": np.nan, "MA_Stack": 0.0,
+            "Hold50": np.nan, "LowPenalty": np.nan, "Return_50D": np.nan
+        }
+
+    last = close[-1]
+
+    nd20 = last / close[-20:].max() - 1 if n >= 20 else np.nan
+    nd50 = last / close[-50:].max() - 1 if n >= 50 else np.nan
+
+    # MA stack: close > SMA_20 > SMA_50
+    ma_stack = 0.0
+    if n >= 50:
+        sma20 = close[-20:].mean()
+        sma50 = close[-50:].mean()
+        if last > sma20 > sma50:
+            ma_stack = 1.0
+
+    # Hold50: share of the last 50 bars closing above their SMA_50
+    held = np.zeros(n, dtype=bool)
+    if n >= 50:
+        sma50_path = np.lib.stride_tricks.sliding_window_view(close, 50).mean(axis=1)
+        held[49:] = close[49:] > sma50_path
+    hold_50 = held[-50:].mean()
+
+    # LowPenalty: share of the last 20 bars that were 20-day lows
+    lows = np.zeros(n, dtype=bool)
+    if n >= 20:
+        min20_path = np.lib.stride_tricks.sliding_window_view(close, 20).min(axis=1)
+        lows[19:] = close[19:] == min20_path
+    low_penalty = lows[-20:].mean()
+
+    return {
         "ND20": nd20,
         "ND50": nd50,
         "MA_Stack": ma_stack,
         "Hold50": hold_50,
         "LowPenalty": low_penalty,
-        "Return_50D": close.iloc[-1] / close.iloc[-51] - 1 if len(close) > 50 else np.nan
+        "Return_50D": last / close[-51] - 1 if n > 50 else np.nan
     }
+    
+# --- Streaming indicator state (one dict per ticker, JSON-serializable) ---
+INDICATOR_STATE_PATH = "data/indicator_state.json"
+
+
+def init_indicator_state() -> dict:
+    """
+    Empty per-ticker streaming state:
+      - rolling sums for SMA_20 / SMA_50 (+ the last 51 closes they slide over)
+      - monotonic deques [[bar, close], ...] for 20/50-day max and min
+      - last 50 hold flags / last 20 new-low flags with running counts
+    """
+    return {
+        "last_date": None,
+        "n": 0,
+        "closes": [],
+        "sum20": 0.0,
+        "sum50": 0.0,
+        "max20": [], "max50": [],
+        "min20": [], "min50": [],
+        "held": [], "held_sum": 0,
+        "lows": [], "lows_sum": 0,
+    }
+
+
+def _push_monotonic(dq: deque, i: int, value: float, window: int, keep_max: bool):
+    while dq and (dq[-1][1] <= value if keep_max else dq[-1][1] >= value):
+        dq.pop()
+    dq.append([i, value])
+    while dq[0][0] <= i - window:
+        dq.popleft()
+
+
+def update_indicator_state(state: dict, date_str: str, close: float) -> dict:
+    """
+    Advances one ticker's state by one bar in O(1) and returns that bar's
+    indicators: build_price_features columns + PTS components + PTS.
+    """
+    i = state["n"]
+    n = i + 1
+
+    closes = deque(state["closes"], maxlen=51)
+    max20, max50 = deque(state["max20"]), deque(state["max50"])
+    min20, min50 = deque(state["min20"]), deque(state["min50"])
+
+    # Higher highs compare against the PRIOR window → read before pushing
+    prior_max20 = max20[0][1] if i >= 20 else np.nan
+    prior_max50 = max50[0][1] if i >= 50 else np.nan
+
+    # Rolling sums (exact re-sum every 250 bars to stop float drift)
+    state["sum20"] += close - (closes[-20] if len(closes) >= 20 else 0.0)
+    state["sum50"] += close - (closes[-50] if len(closes) >= 50 else 0.0)
+    closes.append(close)
+    if n % 250 == 0:
+        tail = list(closes)
+        state["sum20"] = float(np.sum(tail[-20:]))
+        state["sum50"] = float(np.sum(tail[-50:]))
+
+    _push_monotonic(max20, i, close, 20, keep_max=True)
+    _push_monotonic(max50, i, close, 50, keep_max=True)
+    _push_monotonic(min20, i, close, 20, keep_max=False)
+    _push_monotonic(min50, i, close, 50, keep_max=False)
+
+    sma20 = state["sum20"] / 20 if n >= 20 else np.nan
+    sma50 = state["sum50"] / 50 if n >= 50 else np.nan
+
+    new_low_20 = n >= 20 and close == min20[0][1]
+    new_low_50 = n >= 50 and close == min50[0][1]
+    held_today = n >= 50 and close > sma50
+
+    held = deque(state["held"], maxlen=50)
+    if len(held) == 50:
+        state["held_sum"] -= held[0]
+    held.append(int(held_today))
+    state["held_sum"] += int(held_today)
+
+    lows = deque(state["lows"], maxlen=20)
+    if len(lows) == 20:
+        state["lows_sum"] -= lows[0]
+    lows.append(int(new_low_20))
+    state["lows_sum"] += int(new_low_20)
+
+    state.update({
+        "last_date": date_str,
+        "n": n,
+        "closes": list(closes),
+        "max20": list(max20), "max50": list(max50),
+        "min20": list(min20), "min50": list(min50),
+        "held": list(held),
+        "lows": list(lows),
+    })
+
+    components = {
+        "ND20": close / max20[0][1] - 1 if n >= 20 else np.nan,
+        "ND50": close / max50[0][1] - 1 if n >= 50 else np.nan,
+        "MA_Stack": 1.0 if n >= 50 and close > sma20 > sma50 else 0.0,
+        "Hold50": state["held_sum"] / len(held),
+        "LowPenalty": state["lows_sum"] / len(lows),
+        "Return_50D": close / closes[0] - 1 if n > 50 else np.nan,
+    }
+
+    pts = np.clip(
+        0.20 * np.nan_to_num(components["ND20"]) +
+        0.25 * np.nan_to_num(components["ND50"]) +
+        0.20 * components["MA_Stack"] +
+        0.20 * components["Hold50"] -
+        0.15 * components["LowPenalty"],
+        0, 1
+    )
+
+    return {
+        "close": close,
+        "SMA_20": sma20,
+        "SMA_50": sma50,
+        "Pct_From_SMA_20": (close - sma20) / sma20,
+        "Pct_From_SMA_50": (close - sma50) / sma50,
+        "New_Low_20D": bool(new_low_20),
+        "New_Low_50D": bool(new_low_50),
+        "Higher_High_20D": bool(close > prior_max20),
+        "Higher_High_50D": bool(close > prior_max50),
+        "PTS": float(pts),
+        **components,
+    }
+
+
+def advance_indicator_states(states: dict, price_panel: pd.DataFrame) -> pd.DataFrame:
+    """
+    Feeds every bar newer than each ticker's state (all bars for new tickers).
+    Returns the latest bar's indicators per ticker, indexed by Ticker, with
+    its 'Date'. A daily run costs O(new bars), independent of history length.
+    """
+    panel = as_price_panel(price_panel)
+    date_strs = panel.index.strftime("%Y-%m-%d")
+
+    latest = {}
+    for ticker in panel.columns:
+        state = states.setdefault(ticker, init_indicator_state())
+
+        values = panel[ticker].to_numpy()
+        start = 0
+        if state["last_date"] is not None:
+            start = date_strs.searchsorted(state["last_date"], side="right")
+
+            # Adjusted closes get restated (dividends / splits), or the state
+            # predates the panel (run gap longer than the fetch window)
+            # → rebuild from the panel
+            k = start - 1
+            stale = len(date_strs) > 0 and state["last_date"] < date_strs[0]
+            restated = (
+                k >= 0 and date_strs[k] == state["last_date"] and
+                not np.isnan(values[k]) and
+                not np.isclose(values[k], state["closes"][-1], rtol=1e-9, atol=0)
+            )
+            if stale or restated:
+                state = states[ticker] = init_indicator_state()
+                start = 0
+
+        row = None
+        for k in range(start, len(values)):
+            if not np.isnan(values[k]):
+                row = update_indicator_state(state, date_strs[k], float(values[k]))
+
+        if row is not None:
+            latest[ticker] = {"Date": state["last_date"], **row}
+
+    return pd.DataFrame.from_dict(latest, orient="index").rename_axis("Ticker")
+
+
+def prime_price_feature_cache(latest: pd.DataFrame) -> None:
+    """
+    Seeds the per-run feature cache with advance_indicator_states rows so
+    every consumer of (ticker, date) reuses the streamed values.
+    """
+    for ticker, row in latest.iterrows():
+        entry = _PRICE_FEATURE_CACHE.setdefault((ticker, row["Date"]), {})
+        entry.update({k: v for k, v in row.items() if k != "Date"})
+
+
+def load_indicator_states(path: str = INDICATOR_STATE_PATH) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def save_indicator_states(states: dict, path: str = INDICATOR_STATE_PATH):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(states, f)
+    os.replace(tmp_path, path)
+    print(f"[SUCCESS] Indicator state saved → {path} ({len(states)} tickers)")
 
-    return pts_base, components
     
 #Simple Moving Average
 def compute_sma(series, window):
@@ -2209,15 +3704,36 @@ def compute_ma_stack(df: pd.DataFrame) -> float:
         return 1.0
     return 0.0
     
-def _slope(series: np.ndarray) -> float:
-    if len(series) < 2:
-        return np.nan
-    x = np.arange(len(series))
-    try:
-        return np.polyfit(x, series, 1)[0]
-    except Exception:
-        return np.nan
-        
+def compute_rolling_slope(
+    values: pd.DataFrame,
+    window: int,
+    min_periods: int = 2
+) -> pd.DataFrame:
+    """
+    Least-squares slope of every column over its trailing `window` rows
+    (x = 0..n-1, n = rows available up to `window`), all columns at once.
+    Uses rolling sums of y and row·y with closed-form x-moments instead of
+    a polyfit per window. NaN if the window holds a NaN or n < min_periods.
+    """
+    y = values.astype(float)
+    pos = np.arange(len(y), dtype=float)
+
+    sum_y = y.rolling(window, min_periods=1).sum().to_numpy()
+    sum_iy = y.mul(pos, axis=0).rolling(window, min_periods=1).sum().to_numpy()
+    count = y.rolling(window, min_periods=1).count().to_numpy()
+
+    n = np.minimum(pos + 1, window)[:, None]
+    sum_x = n * (n - 1) / 2
+    sum_xx = (n - 1) * n * (2 * n - 1) / 6
+    sum_xy = sum_iy - (pos[:, None] - n + 1) * sum_y
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        slope = (n * sum_xy - sum_x * sum_y) / (n * sum_xx - sum_x ** 2)
+
+    slope = np.where((count == n) & (n >= min_periods), slope, np.nan)
+    return pd.DataFrame(slope, index=values.index, columns=values.columns)
+
+
 def compute_new_low_penalty(close: pd.Series, window: int) -> float:
     """
     Penalizes recent breakdown behavior.
@@ -2959,217 +4475,651 @@ REGIME_VALUATION_MULTIPLIERS = {
 #------------------------------------------------------------------------------------
 #
 #--------------------------------Functions List--------------------------------------
-# A. classify_tech_industry_regime
-# B. compute_tech_industry_snapshot
-# C. compute_subindustry_snapshot
-# D. build_subindustry_regime_features
-# E. classify_subindustry_stock_flow
-# F. combine_subindustry_regimes
-# G. get_subindustry_regime_on_date
-# H. normalize_regime_for_valuation
-# I. build_valuation_weights
-# J. build_final_valuation_weights
-# K. get_trend_weight
-# L. get_regime_multipliers
-# M. resolve_regime_multiplier
-# N. apply_regime_multipliers
+# A. compile_regime_rules
+# B. compile_regime_lookup
+# C. load_regime_rules
+# D. get_regime_rules
+# E. override_regime_thresholds
+# F. evaluate_regime_rules
+# G. lookup_regime_pairs
+# H. classify_industry_regimes
+# I. build_subindustry_regime_matrix
+# J. compute_industry_snapshots
+# K. build_subindustry_industry_map
+# L. compute_subindustry_snapshots
+# M. _cached_feature_rows
+# N. backfill_subindustry_snapshots
+# O. _regime_store_dir
+# P. load_regime_store_index
+# Q. read_regime_store
+# R. append_regime_store
+# S. truncate_regime_store
+# T. _write_regime_store_index
+# U. export_regime_store
+# V. build_subindustry_regime_features
+# W. classify_subindustry_regimes
+# X. classify_subindustry_stock_flow
+# Y. classify_subindustry_stock_flows
+# Z. compute_stock_flow_shares
+# AA. stock_flow_rules
+# AB. build_subindustry_forward_targets
+# AC. _calibration_rows
+# AD. _score_signal_grid
+# AE. _threshold_combos
+# AF. _calibration_steps
+# AG. _calibration_direction
+# AH. calibrate_subindustry_regime_thresholds
+# AI. calibrate_stock_flow_thresholds
+# AJ. run_regime_calibration
+# AK. _regime_runs
+# AL. compute_regime_persistence
+# AM. detect_regime_transitions
+# AN. _regime_store_group_dates
+# AO. record_regime_events
+# AP. combine_subindustry_regimes
+# AQ. combine_subindustry_regime_codes
+# AR. get_subindustry_regime_on_date
+# AS. normalize_regime_for_valuation
+# AT. build_valuation_weights
+# AU. build_final_valuation_weights
+# AV. get_trend_weight
+# AW. get_regime_multipliers
+# AX. resolve_regime_multiplier
+# AY. apply_regime_multipliers
 #------------------------------------------------------------------------------------
 #
 #------------------------------------Functions----------------------------------------
 
-def classify_tech_industry_regime(
-    gdt_regime: str,
-    semi_regime: str,
-    green_regimes: list[str],
-    yellow_regimes: list[str],
-    red_regimes: list[str],
-    warning_regime: str
-) -> str:
+_REGIME_RULES = {}   # name -> {"table": active table, "compiled": evaluator form}
+
+
+def compile_regime_rules(rules) -> list:
+    """
+    Mask rule table → [(code, [(column, ufunc, threshold)])], with label
+    thresholds turned into regime codes. Thresholds may be arrays.
+    """
+    return [
+        (
+            REGIME_CODES[label],
+            [
+                (col, REGIME_RULE_OPS[op], REGIME_CODES[t] if isinstance(t, str) else t)
+                for col, op, t in conditions
+            ]
+        )
+        for label, conditions in rules
+    ]
+
+
+def compile_regime_lookup(table: dict) -> np.ndarray:
+    """
+    Pair lookup table → dense array indexed by (first code + 1, second code + 1);
+    index 0 is a missing / unknown regime. Regime results become int8 codes.
+    """
+    size = len(REGIME_LABELS) + 1
+
+    def positions(side):
+        if side == "*":
+            return list(range(size))
+        labels = [side] if isinstance(side, str) else side
+        return [REGIME_CODES[label] + 1 for label in labels]
+
+    default = table["default"]
+    regime_valued = isinstance(default, str)
+    encode = (lambda v: REGIME_CODES[v]) if regime_valued else float
+
+    lookup = np.full((size, size), encode(default), dtype=np.int8 if regime_valued else float)
+    filled = np.zeros((size, size), dtype=bool)
+
+    for first, second, value in table["rules"]:
+        cells = np.ix_(positions(first), positions(second))
+        lookup[cells] = np.where(filled[cells], lookup[cells], encode(value))
+        filled[cells] = True
+
+    return lookup
+
+
+def load_regime_rules(path: str = REGIME_RULES_PATH) -> dict:
+    """
+    Compiles REGIME_RULE_TABLES, with any table in the JSON file at `path`
+    replacing the built-in one of the same name. Rule changes need no code edits.
+    """
+    tables = dict(REGIME_RULE_TABLES)
+
+    if path and os.path.exists(path):
+        with open(path) as f:
+            overrides = json.load(f)
+        unknown = set(overrides) - set(tables)
+        if unknown:
+            raise ValueError(f"Unknown regime rule tables in {path}: {sorted(unknown)}")
+        tables.update(overrides)
+        print(f"[INFO] Regime rules overridden from {path}: {sorted(overrides)}")
+
+    _REGIME_RULES.clear()
+    for name, table in tables.items():
+        _REGIME_RULES[name] = {
+            "table": table,
+            "compiled": compile_regime_lookup(table) if isinstance(table, dict) else compile_regime_rules(table),
+        }
+    return _REGIME_RULES
+
+
+def get_regime_rules(name: str, compiled: bool = True):
+    """
+    Active rule table `name` (compiled unless `compiled=False`), loading the
+    tables on first use.
+    """
+    if not _REGIME_RULES:
+        load_regime_rules()
+    return _REGIME_RULES[name]["compiled" if compiled else "table"]
+
+
+def override_regime_thresholds(rules, overrides: dict) -> list:
+    """
+    Copy of mask table `rules` with thresholds replaced per
+    {(label, column): threshold} in every matching condition.
+    """
+    return [
+        (label, [(col, op, overrides.get((label, col), t)) for col, op, t in conditions])
+        for label, conditions in rules
+    ]
+
+
+def evaluate_regime_rules(
+    features: dict[str, np.ndarray],
+    rules,
+    eligible=None
+) -> np.ndarray:
+    """
+    Int8 regime codes from a mask table (raw or compiled).
+    Thresholds may be scalars or arrays that broadcast against the feature
+    arrays, e.g. (combos × 1) thresholds over (rows,) features give a
+    (combos × rows) result. NaN features fail every comparison.
+    """
+    if rules and isinstance(rules[0][0], str):
+        rules = compile_regime_rules(rules)
+
+    masks = []
+    for _, conditions in rules:
+        mask = True
+        for col, op, threshold in conditions:
+            mask = mask & op(features[col], threshold)
+        if eligible is not None:
+            mask = mask & eligible
+        masks.append(mask)
+
+    shape = np.broadcast_shapes(*(np.shape(m) for m in masks))
+    return np.select(
+        [np.broadcast_to(m, shape) for m in masks],
+        [code for code, _ in rules],
+        default=REGIME_CODES["Neutral"]
+    ).astype(np.int8)
+
+
+def lookup_regime_pairs(lookup: np.ndarray, first, second) -> np.ndarray:
+    """
+    Elementwise value of a compiled pair lookup table for two regime arrays
+    (labels or codes).
+    """
+    return lookup[encode_regimes(first) + 1, encode_regimes(second) + 1]
+
+
+def classify_industry_regimes(
+    core_regimes,
+    lead_regimes,
+    warning_regimes,
+    green_bullish,
+    green_bear_pct,
+    yellow_bullish,
+    red_bullish
+) -> np.ndarray:
+    """
+    Industry regime rules (the "industry" rule table) evaluated elementwise,
+    so any shape works (one industry over many dates, or a Date × Industry grid).
+    Core / lead / warning are labels or int8 codes; the rest are counts
+    of the industry's green / yellow / red sub-industries. Int8 codes out.
+    """
+    features = {
+        "Core_Regime": encode_regimes(core_regimes),
+        "Lead_Regime": encode_regimes(lead_regimes),
+        "Warning_Regime": encode_regimes(warning_regimes),
+        "Green_Bullish": np.asarray(green_bullish),
+        "Green_Bear_Pct": np.asarray(green_bear_pct),
+        "Yellow_Bullish": np.asarray(yellow_bullish),
+        "Red_Bullish": np.asarray(red_bullish),
+    }
+    return evaluate_regime_rules(features, get_regime_rules("industry"))
+
+
+def build_subindustry_regime_matrix(
+    history_df: pd.DataFrame,
+    regime_col: str = "SubIndustry_Regime",
+    dates=None,
+    subindustries=None
+) -> pd.DataFrame:
+    """
+    Regimes pivoted once into a dense (Date × SubIndustry) int8 code matrix.
+    Missing rows / blank labels are Neutral, as in get_subindustry_regime_on_date.
+    """
+    if history_df.empty or regime_col not in history_df.columns:
+        matrix = pd.DataFrame(dtype=float)
+    else:
+        matrix = (
+            history_df
+            .drop_duplicates(["Date", "SubIndustry"], keep="first")
+            .assign(**{
+                regime_col: lambda d: encode_regimes(d[regime_col]),
+                "SubIndustry": lambda d: d["SubIndustry"].astype(object),
+            })
+            .pivot(index="Date", columns="SubIndustry", values=regime_col)
+        )
+
+    if dates is not None:
+        matrix = matrix.reindex(index=dates)
+    if subindustries is not None:
+        matrix = matrix.reindex(columns=subindustries)
+
+    codes = encode_regimes(matrix.to_numpy(dtype=float))
+    codes[codes == REGIME_MISSING_CODE] = REGIME_CODES["Neutral"]
+    return pd.DataFrame(codes, index=matrix.index, columns=matrix.columns)
+
+
+def compute_industry_snapshots(
+    history_df: pd.DataFrame,
+    registry: dict | None = None,
+    regime_col: str = "SubIndustry_Regime",
+    dates=None
+) -> pd.DataFrame:
     """
-    Returns: 'Bull', 'EarlyBull', 'Neutral', 'Bear'
+    Regime history for every industry in `registry` (default INDUSTRY_REGISTRY)
+    in one pass: a single Date × SubIndustry regime matrix shared by all
+    industries, per-industry counts as membership-matrix products, and one
+    classify_industry_regimes call over the Date × Industry grid.
+    Long format (Date, Industry, ...); regime columns are int8 codes.
     """
+    if registry is None:
+        registry = INDUSTRY_REGISTRY
+
+    industries = list(registry)
+    tiers = ("green", "yellow", "red")
+
+    subindustries = list(dict.fromkeys(
+        sub
+        for spec in registry.values()
+        for sub in [spec["core"], spec.get("lead"), spec.get("warning")]
+                   + [s for tier in tiers for s in spec.get(tier, [])]
+        if sub
+    ))
+
+    matrix = build_subindustry_regime_matrix(
+        history_df,
+        regime_col=regime_col,
+        dates=dates,
+        subindustries=subindustries
+    )
+    codes = matrix.to_numpy()
+    position = {sub: j for j, sub in enumerate(subindustries)}
+
+    def column(role):
+        # Industries without the role read as Neutral
+        neutral = np.full(len(codes), REGIME_CODES["Neutral"], dtype=np.int8)
+        return np.column_stack([
+            codes[:, position[registry[ind][role]]] if registry[ind].get(role) else neutral
+            for ind in industries
+        ])
+
+    membership = {}
+    for tier in tiers:
+        m = np.zeros((len(subindustries), len(industries)))
+        for k, ind in enumerate(industries):
+            for sub in registry[ind].get(tier, []):
+                m[position[sub], k] += 1
+        membership[tier] = m
+
+    bullish = ((codes == REGIME_CODES["Bull"]) | (codes == REGIME_CODES["EarlyBull"])).astype(float)
+    bear = (codes == REGIME_CODES["Bear"]).astype(float)
+
+    green_bullish = (bullish @ membership["green"]).astype(int)
+    green_bear = (bear @ membership["green"]).astype(int)
+    yellow_bullish = (bullish @ membership["yellow"]).astype(int)
+    red_bullish = (bullish @ membership["red"]).astype(int)
+    green_total = np.maximum(membership["green"].sum(axis=0), 1)
+
+    core = column("core")
+    lead = column("lead")
+    warning = column("warning")
+
+    regime = classify_industry_regimes(
+        core, lead, warning,
+        green_bullish=green_bullish,
+        green_bear_pct=green_bear / green_total,
+        yellow_bullish=yellow_bullish,
+        red_bullish=red_bullish
+    )
 
-    green_counts = count_states(green_regimes)
-    yellow_counts = count_states(yellow_regimes)
-    red_counts = count_states(red_regimes)
+    # Date-major ravel: rows are (date, industry) pairs
+    return pd.DataFrame({
+        "Date": np.repeat(matrix.index.to_numpy(), len(industries)),
+        "Industry": pd.Categorical.from_codes(
+            np.tile(np.arange(len(industries)), len(matrix)),
+            categories=industries
+        ),
+        "Industry_Regime": regime.ravel(),
 
-    green_total = max(green_counts["Total"], 1)
-    yellow_total = max(yellow_counts["Total"], 1)
+        # Helpful diagnostics (optional but I recommend keeping)
+        "Core_Regime": core.ravel(),
+        "Lead_Regime": lead.ravel(),
+        "Warning_Regime": warning.ravel(),
+
+        "Green_Bullish": green_bullish.ravel(),
+        "Green_Bear": green_bear.ravel(),
+        "Yellow_Bullish": yellow_bullish.ravel(),
+        "Red_Bullish": red_bullish.ravel(),
+    })
 
-    green_bullish = green_counts["Bull"] + green_counts["EarlyBull"]
-    yellow_bullish = yellow_counts["Bull"] + yellow_counts["EarlyBull"]
 
-    green_bear_pct = green_counts["Bear"] / green_total
-    red_bullish = red_counts["Bull"] + red_counts["EarlyBull"]
+def build_subindustry_industry_map(registry: dict | None = None) -> dict:
+    """
+    SubIndustry -> Industry for every sub-industry named in the registry.
+    A sub-industry listed under several industries belongs to the first.
+    """
+    if registry is None:
+        registry = INDUSTRY_REGISTRY
+
+    mapping = {}
+    for industry, spec in registry.items():
+        for sub in [spec["core"], spec.get("lead"), spec.get("warning")]:
+            if sub:
+                mapping.setdefault(sub, industry)
+        for tier in ("green", "yellow", "red"):
+            for sub in spec.get(tier, []):
+                mapping.setdefault(sub, industry)
+    return mapping
+
+
+def compute_subindustry_snapshots(
+    price_panel: pd.DataFrame,
+    regime_groups: dict = None,
+    dates=None,
+    price_features: dict | None = None,
+    min_stocks: int = 3
+) -> pd.DataFrame:
+    """
+    Breadth snapshot (medians / shares of stocks above SMAs, new lows,
+    higher highs, stock count) for every sub-industry and date at once.
 
-    # -----------------------
-    # BEAR (hard filters)
-    # -----------------------
-    if gdt_regime == "Bear":
-        return "Bear"
+    Breadth means and counts are one matrix product of the per-ticker flags
+    against a ticker × sub-industry membership matrix; medians are one
+    nanmedian per sub-industry over all dates. Rows with fewer than
+    `min_stocks` valid stocks are dropped.
+    """
+    panel = as_price_panel(price_panel)
+    regime_groups = REGIME_GROUPS if regime_groups is None else regime_groups
+
+    if panel.empty:
+        return pd.DataFrame(columns=[
+            "Date", "SubIndustry", "Median_Pct_From_SMA_20", "Median_Pct_From_SMA_50",
+            "New_Low_Ratio_20D", "New_Low_Ratio_50D", "Pct_Higher_Highs_20D", "Pct_Higher_Highs_50D",
+            "Pct_Above_SMA_20", "Pct_Above_SMA_50", "Stock_Count",
+        ])
+
+    if price_features is None:
+        price_features = compute_price_indicator_panel(panel)
+
+    close = price_features["close"]
+    if dates is not None:
+        dates = pd.DatetimeIndex(pd.to_datetime(list(dates))).normalize()
+        dates = dates[dates.isin(close.index)]
+        close = close.loc[dates]
+
+    tickers = close.columns
+    names = list(regime_groups)
+
+    # Membership matrix: tickers × sub-industries
+    membership = np.zeros((len(tickers), len(names)))
+    for j, name in enumerate(names):
+        group = regime_groups[name]
+        members = set(group.get("core", [])) | set(group.get("confirmers", []))
+        membership[:, j] = tickers.isin(members)
+
+    def feature(name):
+        return price_features[name].reindex(index=close.index, columns=tickers).to_numpy(dtype=float)
+
+    valid = close.notna().to_numpy() & ~np.isnan(feature("SMA_20"))
+    pct_20 = np.where(valid, feature("Pct_From_SMA_20"), np.nan)
+    pct_50 = np.where(valid, feature("Pct_From_SMA_50"), np.nan)
+
+    counts = valid.astype(float) @ membership
+
+    def ratio(flags):
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return (np.where(valid, flags, 0.0) @ membership) / counts
+
+    def group_median(values):
+        out = np.full((len(close.index), len(names)), np.nan)
+        for j in range(len(names)):
+            block = values[:, membership[:, j].astype(bool)]
+            has_any = ~np.isnan(block).all(axis=1)
+            if has_any.any():
+                out[has_any, j] = np.nanmedian(block[has_any], axis=1)
+        return out
+
+    columns = {
+        "Median_Pct_From_SMA_20": group_median(pct_20),
+        "Median_Pct_From_SMA_50": group_median(pct_50),
+        "New_Low_Ratio_20D": ratio(feature("New_Low_20D")),
+        "New_Low_Ratio_50D": ratio(feature("New_Low_50D")),
+        "Pct_Higher_Highs_20D": ratio(feature("Higher_High_20D")),
+        "Pct_Higher_Highs_50D": ratio(feature("Higher_High_50D")),
+        "Pct_Above_SMA_20": ratio(pct_20 > 0),
+        "Pct_Above_SMA_50": ratio(pct_50 > 0),
+        "Stock_Count": counts,
+    }
 
-    # Broad breakdown in leadership groups
-    if green_bear_pct >= 0.50:
-        return "Bear"
+    n_dates, n_groups = counts.shape
+    snapshots = pd.DataFrame({
+        "Date": np.repeat(close.index.strftime("%Y-%m-%d").to_numpy(), n_groups),
+        "SubIndustry": np.tile(np.array(names, dtype=object), n_dates),
+        **{col: values.ravel() for col, values in columns.items()},
+    })
 
-    # Warning rollover: if ad-tech is Bear AND reds still holding bullish -> late-cycle/bear risk
-    if warning_regime == "Bear" and red_bullish >= 1:
-        return "Bear"
+    snapshots = snapshots[snapshots["Stock_Count"] >= min_stocks].reset_index(drop=True)
+    snapshots["Stock_Count"] = snapshots["Stock_Count"].astype(int)
 
-    # -----------------------
-    # EARLY BULL (fast-path)
-    # -----------------------
-    if gdt_regime == "Bull" and semi_regime == "Bull":
-        return "EarlyBull"
+    print(
+        f"[DEBUG] Sub-industry snapshots: {len(snapshots)} rows | "
+        f"{n_dates} dates × {n_groups} sub-industries"
+    )
 
-    # Broader EarlyBull: GDT not Bear + >=2 green bullish + warning not Bear
-    if (gdt_regime != "Bear") and (green_bullish >= 2) and (warning_regime != "Bear"):
-        return "EarlyBull"
+    return snapshots
 
-    # -----------------------
-    # CONFIRMED BULL
-    # -----------------------
-    # GDT not Bear + >=3 green bullish + >=1 yellow bullish + warning not Bear
-    if (gdt_regime != "Bear") and (green_bullish >= 3) and (yellow_bullish >= 1) and (warning_regime != "Bear"):
-        return "Bull"
 
-    return "Neutral"
+def _cached_feature_rows(price_panel: pd.DataFrame, date: pd.Timestamp) -> dict[str, pd.DataFrame]:
+    """
+    One-row feature frames for `date` taken from the per-run indicator cache,
+    for compute_subindustry_snapshots on a single day.
+    """
+    panel = as_price_panel(price_panel)
+    rows = {}
+    for ticker in panel.columns:
+        entry = get_price_indicators(ticker, date, panel)
+        if entry is not None:
+            rows[ticker] = {name: entry[name] for name in PRICE_FEATURE_KEYS}
 
+    frame = pd.DataFrame.from_dict(rows, orient="index").reindex(panel.columns)
+    return {
+        name: pd.DataFrame([frame[name].to_numpy(dtype=float)], index=[date], columns=panel.columns)
+        for name in PRICE_FEATURE_KEYS
+    }
 
-def compute_tech_industry_snapshot(
+
+def backfill_subindustry_snapshots(
     history_df: pd.DataFrame,
-    date: pd.Timestamp,
-    regime_col: str = "SubIndustry_Regime"
-) -> dict:
+    price_panel: pd.DataFrame,
+    regime_groups: dict = None,
+    warmup_bars: int = SUBIND_BACKFILL_WARMUP_BARS
+) -> pd.DataFrame:
     """
-    Produces a single row for industry_regime_history.csv
+    Snapshot rows for every (date, sub-industry) in the price window that
+    `history_df` does not have yet. Idempotent: a full history yields nothing.
     """
+    panel = as_price_panel(price_panel)
+    regime_groups = REGIME_GROUPS if regime_groups is None else regime_groups
 
-    gdt = get_subindustry_regime_on_date(history_df, date, TECH_CORE, regime_col=regime_col)
-    semi = get_subindustry_regime_on_date(history_df, date, "Semiconductors", regime_col=regime_col)
-    warning = get_subindustry_regime_on_date(history_df, date, TECH_WARNING, regime_col=regime_col)
-
-    green_regimes = [get_subindustry_regime_on_date(history_df, date, s, regime_col=regime_col) for s in TECH_GREEN]
-    yellow_regimes = [get_subindustry_regime_on_date(history_df, date, s, regime_col=regime_col) for s in TECH_YELLOW]
-    red_regimes = [get_subindustry_regime_on_date(history_df, date, s, regime_col=regime_col) for s in TECH_RED]
+    dates = panel.index[warmup_bars - 1:]
+    if len(dates) == 0:
+        return pd.DataFrame()
 
-    tech_regime = classify_tech_industry_regime(
-        gdt_regime=gdt,
-        semi_regime=semi,
-        green_regimes=green_regimes,
-        yellow_regimes=yellow_regimes,
-        red_regimes=red_regimes,
-        warning_regime=warning
+    keys = pd.MultiIndex.from_product(
+        [dates.strftime("%Y-%m-%d"), list(regime_groups)],
+        names=["Date", "SubIndustry"]
     )
+    if not history_df.empty:
+        have = pd.MultiIndex.from_arrays([
+            pd.to_datetime(history_df["Date"]).dt.strftime("%Y-%m-%d"),
+            history_df["SubIndustry"],
+        ])
+        keys = keys[~keys.isin(have)]
 
-    green_counts = count_states(green_regimes)
-    yellow_counts = count_states(yellow_regimes)
-    red_counts = count_states(red_regimes)
+    if len(keys) == 0:
+        print("[DEBUG] Sub-industry history complete — nothing to backfill")
+        return pd.DataFrame()
 
-    return {
-        "Date": date.strftime("%Y-%m-%d"),
-        "Industry": "Tech",
-        "Tech_Regime": tech_regime,
-
-        # Helpful diagnostics (optional but I recommend keeping)
-        "GDT_Regime": gdt,
-        "Semis_Regime": semi,
-        "Warning_Regime": warning,
-
-        "Green_Bullish": green_counts["Bull"] + green_counts["EarlyBull"],
-        "Green_Bear": green_counts["Bear"],
-        "Yellow_Bullish": yellow_counts["Bull"] + yellow_counts["EarlyBull"],
-        "Red_Bullish": red_counts["Bull"] + red_counts["EarlyBull"],
-    }
+    missing_dates = keys.get_level_values("Date").unique()
+    missing_groups = {name: regime_groups[name] for name in keys.get_level_values("SubIndustry").unique()}
 
+    snapshots = compute_subindustry_snapshots(panel, missing_groups, dates=missing_dates)
+    snapshots = snapshots[
+        pd.MultiIndex.from_frame(snapshots[["Date", "SubIndustry"]]).isin(keys)
+    ].reset_index(drop=True)
 
-def compute_subindustry_snapshot(
-    date_str: str,
-    subindustry_name: str,
-    subindustry_group: dict,
-    price_data: dict
-):
-    tickers = list(
-        set(subindustry_group.get("core", [])) |
-        set(subindustry_group.get("confirmers", []))
+    print(
+        f"[INFO] Backfilled {len(snapshots)} sub-industry snapshots across "
+        f"{snapshots['Date'].nunique()} dates"
     )
+    return snapshots
 
-    rows = []
 
-    # Normalize snapshot date
-    date = pd.to_datetime(date_str).normalize()
+def _regime_store_dir(name: str) -> str:
+    return os.path.join(REGIME_STORE_DIR, name)
 
-    for ticker in tickers:
-        df = price_data.get(ticker)
 
-        if df is None or df.empty:
-            continue
+def load_regime_store_index(name: str) -> dict:
+    """
+    Date index of regime store `name`: {'YYYY-MM-DD': [group, ...]}.
+    """
+    path = os.path.join(_regime_store_dir(name), "_index.json")
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
 
-        df = df.copy()
-        df.index = pd.to_datetime(df.index).normalize()
 
-        if date not in df.index:
-            continue
+def read_regime_store(name: str, start_date=None) -> pd.DataFrame:
+    """
+    Rows of regime store `name`, reading only the monthly partitions from
+    `start_date`'s month on (every partition if None). Regimes come back as
+    int8 codes, identifiers as categoricals.
+    """
+    months = sorted({date[:7] for date in load_regime_store_index(name)})
+    if start_date is not None:
+        first = pd.Timestamp(start_date).strftime("%Y-%m")
+        months = [m for m in months if m >= first]
+
+    frames = [
+        encode_regime_frame(pd.read_parquet(os.path.join(_regime_store_dir(name), f"{month}.parquet")))
+        for month in months
+    ]
+    if not frames:
+        return pd.DataFrame()
+    return encode_regime_frame(pd.concat(frames, ignore_index=True))
 
-        df_feat = build_price_features(df)
 
-        row = df_feat.loc[date]
+def append_regime_store(name: str, rows: pd.DataFrame, key_col: str) -> None:
+    """
+    Writes `rows` into their monthly partitions of regime store `name`.
+    Only partitions touched by `rows` are rewritten; an existing
+    (Date, key_col) row is replaced.
+    """
+    if rows.empty:
+        return
 
-        if pd.isna(row["SMA_20"]):
-            continue
+    store_dir = _regime_store_dir(name)
+    os.makedirs(store_dir, exist_ok=True)
 
-        rows.append({
-            "Pct_From_SMA_20": row["Pct_From_SMA_20"],
-            "Pct_From_SMA_50": row["Pct_From_SMA_50"],
-            "New_Low_20D": int(row["New_Low_20D"]),
-            "New_Low_50D": int(row["New_Low_50D"]),
-            "Higher_High_20D": int(row["Higher_High_20D"]),
-            "Higher_High_50D": int(row["Higher_High_50D"]),
-        })
+    rows = encode_regime_frame(rows.copy())
+    rows["Date"] = pd.to_datetime(rows["Date"])
 
-    if not rows:
-        print(f"[DEBUG] {subindustry_name}: no stocks passed filters on {date_str}")
-        return None
+    for month, part in rows.groupby(rows["Date"].dt.strftime("%Y-%m")):
+        path = os.path.join(store_dir, f"{month}.parquet")
+        if os.path.exists(path):
+            part = pd.concat([encode_regime_frame(pd.read_parquet(path)), part], ignore_index=True)
 
-    if len(rows) < 3:
-        print(
-            f"[WARN] {subindustry_name} has too few valid stocks "
-            f"({len(rows)}) on {date_str}"
+        part = (
+            encode_regime_frame(part)
+            .drop_duplicates(["Date", key_col], keep="last")
+            .sort_values([key_col, "Date"])
+            .reset_index(drop=True)
         )
-        return None
+        part.to_parquet(path + ".tmp", index=False)
+        os.replace(path + ".tmp", path)
+
+    index = load_regime_store_index(name)
+    for date, keys in rows.groupby(rows["Date"].dt.strftime("%Y-%m-%d"))[key_col]:
+        index[date] = sorted(set(index.get(date, [])) | set(keys.astype(str)))
 
-    agg = pd.DataFrame(rows)
+    _write_regime_store_index(name, index)
 
-    snapshot = {
-        "Date": date.strftime("%Y-%m-%d"),
-        "SubIndustry": subindustry_name,
+    print(f"[SUCCESS] Regime store '{name}' updated → {len(rows)} rows across {rows['Date'].nunique()} dates")
 
-        # Central tendency
-        "Median_Pct_From_SMA_20": agg["Pct_From_SMA_20"].median(),
-        "Median_Pct_From_SMA_50": agg["Pct_From_SMA_50"].median(),
 
-        # Weakness / exhaustion
-        "New_Low_Ratio_20D": agg["New_Low_20D"].mean(),
-        "New_Low_Ratio_50D": agg["New_Low_50D"].mean(),
+def truncate_regime_store(name: str, start_date) -> None:
+    """
+    Drops every row of regime store `name` dated `start_date` or later,
+    rewriting only the partitions that hold such rows.
+    """
+    start = pd.Timestamp(start_date).strftime("%Y-%m-%d")
+    index = load_regime_store_index(name)
 
-        # Momentum structure
-        "Pct_Higher_Highs_20D": agg["Higher_High_20D"].mean(),
-        "Pct_Higher_Highs_50D": agg["Higher_High_50D"].mean(),
+    dropped = [date for date in index if date >= start]
+    if not dropped:
+        return
 
-        # Breadth
-        "Pct_Above_SMA_20": (agg["Pct_From_SMA_20"] > 0).mean(),
-        "Pct_Above_SMA_50": (agg["Pct_From_SMA_50"] > 0).mean(),
+    for month in sorted({date[:7] for date in dropped}):
+        path = os.path.join(_regime_store_dir(name), f"{month}.parquet")
+        if not os.path.exists(path):
+            continue
+        part = pd.read_parquet(path)
+        part = part[pd.to_datetime(part["Date"]) < pd.Timestamp(start)]
+        if part.empty:
+            os.remove(path)
+        else:
+            part.to_parquet(path + ".tmp", index=False)
+            os.replace(path + ".tmp", path)
 
-        "Stock_Count": len(agg)
-    }
+    for date in dropped:
+        del index[date]
+    _write_regime_store_index(name, index)
 
-    print(
-        f"[DEBUG] {subindustry_name} | {date.strftime('%Y-%m-%d')} | "
-        f"Stocks used: {len(agg)} | "
-        f"Median SMA20: {snapshot['Median_Pct_From_SMA_20']:.3f}"
-    )
 
-    return snapshot
+def _write_regime_store_index(name: str, index: dict) -> None:
+    """
+    Atomically replaces the _index.json of regime store `name`.
+    """
+    index_path = os.path.join(_regime_store_dir(name), "_index.json")
+    with open(index_path + ".tmp", "w") as f:
+        json.dump(dict(sorted(index.items())), f)
+    os.replace(index_path + ".tmp", index_path)
+
+
+def export_regime_store(name: str, path: str, key_col: str) -> None:
+    """
+    Full CSV export of regime store `name`.
+    """
+    history = read_regime_store(name)
+    if history.empty:
+        return
+    decode_regime_frame(history.sort_values([key_col, "Date"])).to_csv(path, index=False)
+    print(f"[SUCCESS] {name.title()} history exported → {path}")
 
 
 #Subindustry Regime Condition =================
@@ -3178,109 +5128,156 @@ def classify_subindustry_regime(row: pd.Series) -> str:
     Classifies sub-industry cycle regime.
     Returns: 'EarlyBull', 'Bull', 'Neutral', or 'Bear'
     """
-    REQUIRED_COLS = [
-        "Pct_Above_SMA_20_5D",
-        "Pct_Above_SMA_50_5D",
-        "New_Low_Ratio_20D_5D",
-        "Pct_Higher_Highs_20D_5D",
-        "Pct_Higher_Highs_50D_5D",
-        "Slope_Median_Pct_From_SMA_20",
-    ]
-    
-    if row[REQUIRED_COLS].isna().any():
-        return "Neutral"
+    return decode_regimes(classify_subindustry_regimes(row.to_frame().T))[0]
 
-    # --- Confirmed Bull ---
-    if (
-        row["Pct_Above_SMA_20_5D"] >= 0.65 and
-        row["Pct_Above_SMA_50_5D"] >= 0.55 and
-        row["Pct_Higher_Highs_50D_5D"] >= 0.50 and
-        row["Slope_Median_Pct_From_SMA_20"] >= 0 and
-        row["New_Low_Ratio_20D_5D"] <= 0.15
-    ):
-        return "Bull"
-        
-    # --- Early Bull (indicator) ---
-    if (
-        row["Median_Pct_From_SMA_20"] > 0 and
-        row["Median_Pct_From_SMA_50"] > 0 and
-        row["Pct_Above_SMA_20_5D"] >= 0.55 and
-        row["Pct_Higher_Highs_20D_5D"] >= 0.40 and
-        row["New_Low_Ratio_20D_5D"] <= 0.25
-    ):
-        return "EarlyBull"
-    # --- Bear / rollover ---
-    
-    if (
-        row["Median_Pct_From_SMA_20"] < 0 and
-        row["Pct_Above_SMA_20_5D"] < 0.40 and
-        row["Pct_Above_SMA_50_5D"] < 0.35 and
-        row["Slope_Median_Pct_From_SMA_20"] < 0 and
-        row["New_Low_Ratio_20D_5D"] > 0.30
-    ):
-        return "Bear"
-        
-    return "Neutral"
+
+def classify_subindustry_regimes(df: pd.DataFrame, rules: list | None = None) -> pd.Series:
+    """
+    classify_subindustry_regime for every row at once, as int8 codes.
+    Rules (default: the active "subindustry_structural" table) are evaluated
+    as column masks; rows missing a rolling feature are Neutral.
+    """
+    rules = get_regime_rules("subindustry_structural") if rules is None else compile_regime_rules(rules)
+
+    columns = {col for _, conditions in rules for col, _, _ in conditions}
+    features = {col: df[col].to_numpy(dtype=float) for col in columns}
+
+    complete = df[SUBIND_REGIME_REQUIRED_COLS].notna().all(axis=1).to_numpy()
+
+    codes = evaluate_regime_rules(features, rules, eligible=complete)
+    return pd.Series(codes, index=df.index)
 #=======================
 def classify_subindustry_stock_flow(
     subindustry_name: str,
     daily_stock_pts: pd.DataFrame,
-    min_core_pct: float = 0.40,
-    min_confirmer_pct: float = 0.40,
+    min_core_pct: float | None = None,
+    min_confirmer_pct: float | None = None,
 ) -> str:
     """
     Determines sub-industry regime using core (leaders) and confirmers.
+    All rows of `daily_stock_pts` are treated as one as-of date.
     """
+    flows = classify_subindustry_stock_flows(
+        daily_stock_pts.assign(Date=0),
+        regime_groups={subindustry_name: REGIME_GROUPS[subindustry_name]},
+        min_core_pct=min_core_pct,
+        min_confirmer_pct=min_confirmer_pct
+    )
+    if flows.empty:
+        return "Neutral"
+    return decode_regimes(flows["StockFlow_Regime"])[0]
 
-    group = REGIME_GROUPS[subindustry_name]
 
-    core_stocks = daily_stock_pts[
-        daily_stock_pts["Ticker"].isin(group["core"])
-    ]
+def classify_subindustry_stock_flows(
+    stock_pts: pd.DataFrame,
+    regime_groups: dict = None,
+    min_core_pct: float | None = None,
+    min_confirmer_pct: float | None = None,
+) -> pd.DataFrame:
+    """
+    Stock-flow regime for every (Date, SubIndustry) in one grouped pass.
+    `stock_pts` holds Date / Ticker / PTS rows (one or many dates); a ticker
+    counts toward every group that lists it as core or confirmer.
+    Thresholds left as None come from the "stock_flow" rule table.
+    Returns Date, SubIndustry, StockFlow_Regime (int8 code) for each date × group.
+    """
+    shares = compute_stock_flow_shares(stock_pts, regime_groups)
 
-    confirmer_stocks = daily_stock_pts[
-        daily_stock_pts["Ticker"].isin(group.get("confirmers", []))
-    ]
+    if min_core_pct is None and min_confirmer_pct is None:
+        rules = get_regime_rules("stock_flow")
+    else:
+        rules = stock_flow_rules(min_core_pct, min_confirmer_pct)
 
-    if core_stocks.empty:
-        return "Neutral"
+    codes = evaluate_regime_rules(
+        {col: shares[col].to_numpy() for col in ("Core_Bull_Pct", "Core_Bear_Pct", "Confirmer_Bull_Pct")},
+        rules
+    )
 
-    # ---- Bull detection ----
-    core_bull_pct = (core_stocks["PTS"] >= 0.65).mean()
+    return pd.DataFrame({
+        "Date": shares["Date"],
+        "SubIndustry": shares["SubIndustry"],
+        "StockFlow_Regime": codes,
+    })
 
-    confirmer_bull_pct = (
-        (confirmer_stocks["PTS"] >= 0.65).mean()
-        if not confirmer_stocks.empty
-        else 0.0
-    )
 
-    # ---- Bear detection (leader failure) ----
-    core_bear_pct = (core_stocks["PTS"] <= 0.35).mean()
+def compute_stock_flow_shares(
+    stock_pts: pd.DataFrame,
+    regime_groups: dict = None,
+    bull_pts: float = STOCK_FLOW_BULL_PTS,
+    bear_pts: float = STOCK_FLOW_BEAR_PTS
+) -> pd.DataFrame:
+    """
+    Share of bullish / bearish core names and bullish confirmers for each
+    date × group of `stock_pts`. No core rows → NaN (every rule fails →
+    Neutral); no confirmers → 0.0. No PTS rows → an empty frame.
+    """
+    regime_groups = REGIME_GROUPS if regime_groups is None else regime_groups
+
+    if stock_pts.empty or not {"Date", "Ticker", "PTS"} <= set(stock_pts.columns):
+        return pd.DataFrame({
+            "Date": pd.Series(dtype=object),
+            "SubIndustry": pd.Categorical([]),
+            "Core_Bull_Pct": pd.Series(dtype=float),
+            "Core_Bear_Pct": pd.Series(dtype=float),
+            "Confirmer_Bull_Pct": pd.Series(dtype=float),
+        })
 
-    confirmer_bear_pct = (
-        (confirmer_stocks["PTS"] <= 0.35).mean()
-        if not confirmer_stocks.empty
-        else 0.0
-    )
+    membership = pd.DataFrame(
+        [
+            (name, ticker, role)
+            for name, group in regime_groups.items()
+            for role, key in (("core", "core"), ("confirmer", "confirmers"))
+            for ticker in group.get(key, [])
+        ],
+        columns=["SubIndustry", "Ticker", "Role"]
+    ).drop_duplicates()
 
-    # ---- Regime rules (ORDER MATTERS) ----
+    flows = stock_pts[["Date", "Ticker", "PTS"]].astype({"Ticker": object}).merge(membership, on="Ticker")
+    flows["Bull"] = flows["PTS"] >= bull_pts
+    flows["Bear"] = flows["PTS"] <= bear_pts
 
-    # 1️⃣ Distribution / Bear
-    if core_bear_pct >= 0.60:
-        return "Bear"
+    pct = flows.groupby(["Date", "SubIndustry", "Role"])[["Bull", "Bear"]].mean().unstack("Role")
 
-    # 2️⃣ Confirmed Bull
-    if core_bull_pct >= min_core_pct and confirmer_bull_pct >= min_confirmer_pct:
-        return "Bull"
+    keys = pd.MultiIndex.from_product(
+        [stock_pts["Date"].unique(), list(regime_groups)],
+        names=["Date", "SubIndustry"]
+    )
+    pct = pct.reindex(keys)
+
+    def column(measure, role):
+        if (measure, role) in pct.columns:
+            return pct[(measure, role)].to_numpy(dtype=float)
+        return np.full(len(pct), np.nan)
+
+    return pd.DataFrame({
+        "Date": keys.get_level_values("Date"),
+        "SubIndustry": pd.Categorical(keys.get_level_values("SubIndustry")),
+        "Core_Bull_Pct": column("Bull", "core"),
+        "Core_Bear_Pct": column("Bear", "core"),
+        "Confirmer_Bull_Pct": np.nan_to_num(column("Bull", "confirmer"), nan=0.0),
+    })
 
-    # 3️⃣ Early Bull (leaders only)
-    if core_bull_pct >= min_core_pct:
-        return "EarlyBull"
-        
-    if len(core_stocks) < 3:
-        return "Neutral"
 
-    return "Neutral"
+def stock_flow_rules(
+    min_core_pct=None,
+    min_confirmer_pct=None,
+    core_bear_pct=None
+) -> list:
+    """
+    The active "stock_flow" rule table with the given thresholds swapped in
+    (None keeps the table's value). Thresholds may be arrays, as in the
+    calibration grid.
+    """
+    overrides = {}
+    if min_core_pct is not None:
+        overrides[("Bull", "Core_Bull_Pct")] = min_core_pct
+        overrides[("EarlyBull", "Core_Bull_Pct")] = min_core_pct
+    if min_confirmer_pct is not None:
+        overrides[("Bull", "Confirmer_Bull_Pct")] = min_confirmer_pct
+    if core_bear_pct is not None:
+        overrides[("Bear", "Core_Bear_Pct")] = core_bear_pct
+
+    return override_regime_thresholds(get_regime_rules("stock_flow", compiled=False), overrides)
 
 
 def build_subindustry_regime_features(
@@ -3302,16 +5299,16 @@ def build_subindustry_regime_features(
     df["Above_SMA50"] = df["ND50"] > 0
 
     df["Higher_High_20"] = (
-        df.groupby("Ticker")["ND20"].diff() > 0
+        df.groupby("Ticker", observed=True)["ND20"].diff() > 0
     )
     df["Higher_High_50"] = (
-        df.groupby("Ticker")["ND50"].diff() > 0
+        df.groupby("Ticker", observed=True)["ND50"].diff() > 0
     )
 
     # ----------------------------------
     # Aggregate to sub-industry per date
     # ----------------------------------
-    grouped = df.groupby(["Date", "SubIndustry"])
+    grouped = df.groupby(["Date", "SubIndustry"], observed=True)
 
     snapshot = grouped.agg(
         Pct_Above_SMA_20=("Above_SMA20", "mean"),
@@ -3333,84 +5330,551 @@ def build_subindustry_regime_features(
     ]:
         snapshot[f"{col}_5D"] = (
             snapshot
-            .groupby("SubIndustry")[col]
+            .groupby("SubIndustry", observed=True)[col]
             .rolling(window)
             .mean()
             .reset_index(level=0, drop=True)
         )
 
     # ----------------------------------
-    # Median slope of ND20
+    # Median slope of ND20 (trailing `window` rows per stock)
     # ----------------------------------
-    slope_df = (
-        df.groupby(["SubIndustry", "Ticker"])
-        .apply(
-            lambda g: pd.Series({
-                "Slope": _slope(g["ND20"].tail(window).values)
-            })
-        )
-        .reset_index()
-    )
+    df["Obs"] = df.groupby(["SubIndustry", "Ticker"], observed=True).cumcount()
+    nd20 = df.pivot(index="Obs", columns=["SubIndustry", "Ticker"], values="ND20")
+
+    slopes = compute_rolling_slope(nd20, window).to_numpy()
+    cols = nd20.columns.get_indexer(pd.MultiIndex.from_frame(df[["SubIndustry", "Ticker"]]))
+    df["Slope"] = slopes[df["Obs"].to_numpy(), cols]
 
     slope_snapshot = (
-        slope_df.groupby("SubIndustry")["Slope"]
+        df.groupby(["Date", "SubIndustry"], observed=True)["Slope"]
         .median()
         .rename("Slope_Median_Pct_From_SMA_20")
         .reset_index()
     )
 
-    # ----------------------------------
-    # Final merge
-    # ----------------------------------
-    snapshot = snapshot.merge(
-        slope_snapshot,
-        on="SubIndustry",
-        how="left"
-    )
+    # ----------------------------------
+    # Final merge
+    # ----------------------------------
+    snapshot = snapshot.merge(
+        slope_snapshot,
+        on=["Date", "SubIndustry"],
+        how="left"
+    )
+
+    return snapshot
+    
+    
+def build_subindustry_forward_targets(
+    price_panel: pd.DataFrame,
+    regime_groups: dict = None,
+    horizon: int = REGIME_CALIBRATION_HORIZON
+) -> pd.DataFrame:
+    """
+    Forward outcome of every (Date, SubIndustry) in the panel: the equal-weight
+    member return over the next `horizon` bars, and how many bars until that
+    window's peak / trough. The last `horizon` dates have no outcome (NaN).
+    """
+    panel = as_price_panel(price_panel)
+    regime_groups = REGIME_GROUPS if regime_groups is None else regime_groups
+    groups = list(regime_groups)
+
+    position = {t: i for i, t in enumerate(panel.columns)}
+    membership = np.zeros((len(panel.columns), len(groups)))
+    for k, name in enumerate(groups):
+        group = regime_groups[name]
+        for t in set(group.get("core", [])) | set(group.get("confirmers", [])):
+            if t in position:
+                membership[position[t], k] = 1
+
+    close = panel.to_numpy(dtype=float)
+    returns = np.full_like(close, np.nan)
+    returns[1:] = close[1:] / close[:-1] - 1
+    traded = ~np.isnan(returns)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        group_returns = (np.nan_to_num(returns) @ membership) / (traded @ membership)
+    level = np.cumprod(1 + np.nan_to_num(group_returns), axis=0)
+
+    n_dates = len(panel.index)
+    fwd_return = np.full((n_dates, len(groups)), np.nan)
+    peak_lag = np.full((n_dates, len(groups)), np.nan)
+    trough_lag = np.full((n_dates, len(groups)), np.nan)
+
+    if n_dates > horizon:
+        # windows[d] = level[d + 1 : d + 1 + horizon]
+        windows = np.lib.stride_tricks.sliding_window_view(level[1:], horizon, axis=0)
+        scored = n_dates - horizon
+        fwd_return[:scored] = windows[..., -1] / level[:scored] - 1
+        peak_lag[:scored] = windows.argmax(axis=-1) + 1
+        trough_lag[:scored] = windows.argmin(axis=-1) + 1
+
+    return pd.DataFrame({
+        "Date": np.repeat(panel.index.to_numpy(), len(groups)),
+        "SubIndustry": np.tile(np.array(groups, dtype=object), n_dates),
+        "Fwd_Return": fwd_return.ravel(),
+        "Peak_Lag": peak_lag.ravel(),
+        "Trough_Lag": trough_lag.ravel(),
+    })
+
+
+def _calibration_rows(rows: pd.DataFrame, targets: pd.DataFrame) -> pd.DataFrame:
+    """
+    `rows` joined to their forward targets, ordered by (SubIndustry, Date),
+    with Prev_Row pointing at the group's previous row (-1 at its start).
+    """
+    rows = rows.assign(
+        Date=pd.to_datetime(rows["Date"]),
+        SubIndustry=rows["SubIndustry"].astype(object)
+    )
+    targets = targets.assign(
+        Date=pd.to_datetime(targets["Date"]),
+        SubIndustry=targets["SubIndustry"].astype(object)
+    )
+
+    data = (
+        rows.merge(targets, on=["Date", "SubIndustry"], how="inner")
+        .sort_values(["SubIndustry", "Date"])
+        .reset_index(drop=True)
+    )
+
+    group = data["SubIndustry"].to_numpy()
+    same_group = np.r_[False, group[1:] == group[:-1]]
+    data["Prev_Row"] = np.where(same_group, np.arange(len(data)) - 1, -1)
+    return data
+
+
+def _score_signal_grid(signal: np.ndarray, data: pd.DataFrame, direction: int) -> dict:
+    """
+    Per-combination metrics of a (combos × rows) signal mask.
+    Hit rate: share of signal rows whose forward return has the signal's sign.
+    Lead time: mean bars from a signal onset (signal on, previous row off)
+    to the forward peak (bullish) or trough (Bear).
+    """
+    fwd = data["Fwd_Return"].to_numpy(dtype=float)
+    lag = data["Peak_Lag" if direction > 0 else "Trough_Lag"].to_numpy(dtype=float)
+    prev = data["Prev_Row"].to_numpy()
+
+    scored = signal & ~np.isnan(fwd)
+    was_on = np.where(prev >= 0, signal[:, np.maximum(prev, 0)], False)
+    onset = scored & ~was_on
+
+    signals = scored.sum(axis=1)
+    onsets = onset.sum(axis=1)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return {
+            "Signals": signals,
+            "Onsets": onsets,
+            "Hit_Rate": (scored & (direction * fwd > 0)).sum(axis=1) / signals,
+            "Avg_Fwd_Return": np.where(scored, np.nan_to_num(fwd), 0).sum(axis=1) / signals,
+            "Lead_Time": np.where(onset, np.nan_to_num(lag), 0).sum(axis=1) / onsets,
+        }
+
+
+def _threshold_combos(grid: dict) -> np.ndarray:
+    """
+    Cartesian product of the grid's value lists as a (combos × params) array.
+    """
+    values = [np.asarray(v, dtype=float) for v in grid.values()]
+    return np.stack(np.meshgrid(*values, indexing="ij"), axis=-1).reshape(-1, len(values))
+
+
+def _calibration_steps(column: str) -> np.ndarray:
+    """
+    Default grid offsets for a threshold on `column`.
+    """
+    return np.array(REGIME_CALIBRATION_COLUMN_STEPS.get(column, REGIME_CALIBRATION_STEPS))
+
+
+def _calibration_direction(rule: str) -> int:
+    """
+    +1 for bullish rules (scored on gains / peaks), -1 for Bear.
+    """
+    if rule in ("Bull", "EarlyBull"):
+        return 1
+    if rule == "Bear":
+        return -1
+    raise ValueError(f"Cannot calibrate regime rule: {rule}")
+
+
+def calibrate_subindustry_regime_thresholds(
+    history_df: pd.DataFrame,
+    targets: pd.DataFrame,
+    rule: str = "Bull",
+    grid: dict | None = None,
+    chunk_size: int | None = None
+) -> pd.DataFrame:
+    """
+    Hit rate and lead time of structural regime `rule` for every threshold
+    combination in `grid` ({(label, column): values}); by default each
+    threshold of `rule` ± its column's steps (REGIME_CALIBRATION_COLUMN_STEPS,
+    else REGIME_CALIBRATION_STEPS). Thresholds not in the
+    grid keep their value in the active "subindustry_structural" table.
+    Each chunk of combinations is one (combos × rows) broadcast through
+    evaluate_regime_rules, so precedence matches the live classifier.
+    """
+    direction = _calibration_direction(rule)
+    table = get_regime_rules("subindustry_structural", compiled=False)
+
+    if grid is None:
+        grid = {
+            (rule, col): threshold + _calibration_steps(col)
+            for label, conditions in table if label == rule
+            for col, _, threshold in conditions
+        }
+
+    data = _calibration_rows(history_df, targets)
+
+    columns = {col for _, conditions in table for col, _, _ in conditions}
+    features = {col: data[col].to_numpy(dtype=float) for col in columns}
+    complete = data[SUBIND_REGIME_REQUIRED_COLS].notna().all(axis=1).to_numpy()
+
+    combos = _threshold_combos(grid)
+    if chunk_size is None:
+        chunk_size = max(1, REGIME_CALIBRATION_MAX_CELLS // max(len(data), 1))
+
+    metrics = []
+    for start in range(0, len(combos), chunk_size):
+        chunk = combos[start:start + chunk_size]
+        rules = override_regime_thresholds(table, {key: chunk[:, [p]] for p, key in enumerate(grid)})
+
+        signal = evaluate_regime_rules(features, rules, eligible=complete) == REGIME_CODES[rule]
+        metrics.append(_score_signal_grid(np.atleast_2d(signal), data, direction))
+
+    result = pd.DataFrame(combos, columns=[f"{label}.{col}" for label, col in grid])
+    for name in metrics[0] if metrics else []:
+        result[name] = np.concatenate([m[name] for m in metrics])
+    return result
+
+
+def calibrate_stock_flow_thresholds(
+    stock_pts: pd.DataFrame,
+    targets: pd.DataFrame,
+    regime_groups: dict = None,
+    rule: str = "Bull",
+    grid: dict | None = None,
+    chunk_size: int | None = None
+) -> pd.DataFrame:
+    """
+    calibrate_subindustry_regime_thresholds for the stock-flow regime.
+    Grid keys: bull_pts, bear_pts, min_core_pct, min_confirmer_pct,
+    core_bear_pct (default: each ± REGIME_CALIBRATION_STEPS).
+    Shares are computed once per distinct PTS cutoff; the rules are then
+    broadcast over every combination.
+    """
+    direction = _calibration_direction(rule)
+
+    thresholds = {
+        (label, col): t
+        for label, conditions in get_regime_rules("stock_flow", compiled=False)
+        for col, _, t in conditions
+    }
+    defaults = {
+        "bull_pts": STOCK_FLOW_BULL_PTS,
+        "bear_pts": STOCK_FLOW_BEAR_PTS,
+        "min_core_pct": thresholds[("Bull", "Core_Bull_Pct")],
+        "min_confirmer_pct": thresholds[("Bull", "Confirmer_Bull_Pct")],
+        "core_bear_pct": thresholds[("Bear", "Core_Bear_Pct")],
+    }
+    if grid is None:
+        grid = {name: value + _calibration_steps(name) for name, value in defaults.items()}
+
+    combos = _threshold_combos(grid)
+    params = {
+        name: combos[:, list(grid).index(name)] if name in grid else np.full(len(combos), value)
+        for name, value in defaults.items()
+    }
+
+    # Every cutoff's shares share one (Date, SubIndustry) key order
+    bull_cuts, bull_idx = np.unique(params["bull_pts"], return_inverse=True)
+    bear_cuts, bear_idx = np.unique(params["bear_pts"], return_inverse=True)
+
+    keys = None
+    bull_shares, bear_shares = [], []
+    for cut in bull_cuts:
+        shares = compute_stock_flow_shares(stock_pts, regime_groups, bull_pts=cut)
+        keys = shares[["Date", "SubIndustry"]] if keys is None else keys
+        bull_shares.append(shares[["Core_Bull_Pct", "Confirmer_Bull_Pct"]].to_numpy())
+    for cut in bear_cuts:
+        shares = compute_stock_flow_shares(stock_pts, regime_groups, bear_pts=cut)
+        bear_shares.append(shares["Core_Bear_Pct"].to_numpy())
+
+    data = _calibration_rows(keys.assign(Row=np.arange(len(keys))), targets)
+    rows = data["Row"].to_numpy()
+
+    bull_shares = np.stack(bull_shares)[:, rows]       # cutoffs × rows × (core, confirmer)
+    bear_shares = np.stack(bear_shares)[:, rows]       # cutoffs × rows
+
+    if chunk_size is None:
+        chunk_size = max(1, REGIME_CALIBRATION_MAX_CELLS // max(len(data), 1))
+
+    metrics = []
+    for start in range(0, len(combos), chunk_size):
+        part = slice(start, start + chunk_size)
+
+        features = {
+            "Core_Bull_Pct": bull_shares[bull_idx[part], :, 0],
+            "Confirmer_Bull_Pct": bull_shares[bull_idx[part], :, 1],
+            "Core_Bear_Pct": bear_shares[bear_idx[part]],
+        }
+        rules = stock_flow_rules(
+            params["min_core_pct"][part, None],
+            params["min_confirmer_pct"][part, None],
+            params["core_bear_pct"][part, None]
+        )
+
+        signal = evaluate_regime_rules(features, rules) == REGIME_CODES[rule]
+        metrics.append(_score_signal_grid(signal, data, direction))
+
+    result = pd.DataFrame(combos, columns=list(grid))
+    for name in metrics[0] if metrics else []:
+        result[name] = np.concatenate([m[name] for m in metrics])
+    return result
+
+
+def run_regime_calibration(
+    price_panel: pd.DataFrame | None = None,
+    stock_pts_path: str = "data/stock_price_trend_history.csv",
+    output_dir: str = "data/regime_calibration",
+    horizon: int = REGIME_CALIBRATION_HORIZON
+) -> dict[str, pd.DataFrame]:
+    """
+    Calibration grids for every structural and stock-flow rule against the
+    stored sub-industry history, written as CSVs (best hit rate first).
+    Only dates covered by the price panel are scored. Unless a panel is
+    passed, the full local price history (LOCAL_PRICE_PATH) is used when it
+    reaches the mapped panel's last date, else the mapped panel (the last
+    fetch window only).
+    """
+    history_df = read_regime_store("subindustry")
+    stock_pts = pd.read_csv(stock_pts_path) if os.path.exists(stock_pts_path) else pd.DataFrame()
+
+    if price_panel is None:
+        mapped = load_price_panel_mmap() if os.path.exists(f"{PRICE_PANEL_MMAP_PATH}.json") else None
+        local = None
+        if os.path.exists(LOCAL_PRICE_PATH):
+            start = pd.to_datetime(history_df["Date"]).min() if not history_df.empty else pd.Timestamp("1900-01-01")
+            local = as_price_panel(fetch_prices_local(
+                flatten_ticker_groups(REGIME_GROUPS),
+                start.strftime("%Y-%m-%d"),
+                pipeline_today().strftime("%Y-%m-%d")
+            ))
+
+        if local is not None and not local.empty and (mapped is None or local.index.max() >= mapped.index.max()):
+            price_panel = local
+        else:
+            if local is not None:
+                print(f"[WARN] Calibration: {LOCAL_PRICE_PATH} is behind the mapped panel → using the mapped panel")
+            if mapped is None:
+                raise FileNotFoundError(f"No price panel at {PRICE_PANEL_MMAP_PATH} or {LOCAL_PRICE_PATH}")
+            price_panel = mapped
+
+    targets = build_subindustry_forward_targets(price_panel, horizon=horizon)
+
+    if not history_df.empty:
+        dates = pd.to_datetime(history_df["Date"])
+        before = (dates < price_panel.index.min()).sum()
+        after = (dates > price_panel.index.max()).sum()
+        if before:
+            print(f"[WARN] Calibration: {before} stored rows predate the price panel → not scored")
+        if after:
+            print(f"[WARN] Calibration: {after} stored rows are newer than the price panel → not scored")
+
+    os.makedirs(output_dir, exist_ok=True)
+    results = {}
+
+    for rule in ("Bull", "EarlyBull", "Bear"):
+        if not history_df.empty:
+            results[f"structural_{rule}"] = calibrate_subindustry_regime_thresholds(history_df, targets, rule)
+        if not stock_pts.empty:
+            results[f"stock_flow_{rule}"] = calibrate_stock_flow_thresholds(stock_pts, targets, rule=rule)
+
+    for name, result in results.items():
+        result = result.sort_values(["Hit_Rate", "Lead_Time"], ascending=False)
+        result.to_csv(os.path.join(output_dir, f"{name}.csv"), index=False)
+        print(f"[SUCCESS] Calibration {name}: {len(result)} combinations → {output_dir}/{name}.csv")
+
+    return results
+
+
+def _regime_runs(codes: np.ndarray, groups: np.ndarray):
+    """
+    Run-length encoding of regime codes within consecutive groups.
+    Returns (run length at each row, first row of each row's group).
+    Missing codes never extend a run.
+    """
+    n = len(codes)
+    rows = np.arange(n)
+
+    group_start = np.ones(n, dtype=bool)
+    group_start[1:] = groups[1:] != groups[:-1]
+
+    run_start = group_start.copy()
+    run_start[1:] |= codes[1:] != codes[:-1]
+    run_start |= codes == REGIME_MISSING_CODE
+
+    run_length = rows - np.maximum.accumulate(np.where(run_start, rows, 0)) + 1
+    group_first = np.maximum.accumulate(np.where(group_start, rows, 0))
+    return run_length, group_first
+
+
+def compute_regime_persistence(
+    regimes: pd.Series,
+    groups: pd.Series = None,
+    min_run: int = REGIME_PERSIST_MIN_RUN,
+    initial: dict | pd.Series = None
+) -> pd.Series:
+    """
+    Persisted regime per row: the latest regime that has held for at least
+    `min_run` consecutive rows within its group (NaN until one has, or the
+    group's `initial` persisted regime when history is resumed mid-way).
+    Rows must be sorted by group, then date. min_run=2 is the classic
+    s.where(s == s.shift()).ffill(). Returns int8 codes for code input,
+    labels for label input.
+    """
+    codes = encode_regimes(regimes)
+    as_codes = np.asarray(regimes).dtype.kind in "iuf"
+
+    if groups is None:
+        group_ids = np.zeros(len(codes))
+    elif isinstance(groups.dtype, pd.CategoricalDtype):
+        group_ids = groups.cat.codes.to_numpy()
+    else:
+        group_ids = np.asarray(groups)
+
+    run_length, group_first = _regime_runs(codes, group_ids)
+    rows = np.arange(len(codes))
+
+    confirmed = (run_length >= min_run) & (codes != REGIME_MISSING_CODE)
+    last_confirmed = np.maximum.accumulate(np.where(confirmed, rows, -1))
+    held = last_confirmed >= group_first
+
+    persisted = np.where(held, codes[np.maximum(last_confirmed, 0)], REGIME_MISSING_CODE)
+
+    if initial is not None:
+        initial = {str(group): regime for group, regime in pd.Series(initial, dtype=object).items()}
+        seed = encode_regimes(pd.Series(np.asarray(groups, dtype=object)).map(initial).to_numpy(dtype=object))
+        persisted = np.where(held, persisted, seed)
+
+    if as_codes:
+        return pd.Series(persisted.astype(np.int8), index=regimes.index, name=regimes.name)
+    return pd.Series(decode_regimes(persisted), index=regimes.index, name=regimes.name)
+
+
+def detect_regime_transitions(
+    rows: pd.DataFrame,
+    key_col: str,
+    regime_col: str,
+    start_date,
+    drivers: list | None = None
+) -> pd.DataFrame:
+    """
+    Regime flips dated `start_date` or later. Only those rows are scanned,
+    each group's first one against its last earlier row in `rows`;
+    missing regimes never flip.
+    Returns Date, Group, From_Regime, To_Regime (codes) and the `drivers`
+    columns as of the flip.
+    """
+    start = pd.Timestamp(start_date)
+    if rows.empty or not {"Date", key_col, regime_col} <= set(rows.columns):
+        rows = pd.DataFrame({"Date": pd.to_datetime([]), key_col: [], regime_col: []})
+    rows = rows.assign(Date=pd.to_datetime(rows["Date"])).sort_values([key_col, "Date"])
+
+    before = rows["Date"] < start
+    seeds = rows.loc[before].groupby(key_col, observed=True).tail(1).index
+    scan = rows.loc[~before | rows.index.isin(seeds)]
+
+    codes = encode_regimes(scan[regime_col])
+    group = scan[key_col].astype(object).to_numpy()
+
+    previous = np.r_[REGIME_MISSING_CODE, codes[:-1]].astype(np.int8)
+    same_group = np.r_[False, group[1:] == group[:-1]]
+
+    flip = (
+        same_group
+        & (codes != previous)
+        & (codes != REGIME_MISSING_CODE)
+        & (previous != REGIME_MISSING_CODE)
+        & (scan["Date"] >= start).to_numpy()
+    )
+
+    events = pd.DataFrame({
+        "Date": scan["Date"].to_numpy()[flip],
+        "Group": group[flip],
+        "From_Regime": previous[flip],
+        "To_Regime": codes[flip],
+    })
+    for col in drivers or []:
+        events[col] = scan[col].to_numpy()[flip] if col in scan.columns else np.nan
+    return events
+
+
+def _regime_store_group_dates(name: str) -> dict[str, np.ndarray]:
+    """
+    {group: sorted 'YYYY-MM-DD' dates} from the index of regime store `name`.
+    """
+    dates = {}
+    for date, groups in sorted(load_regime_store_index(name).items()):
+        for group in groups:
+            dates.setdefault(group, []).append(date)
+    return {group: np.array(values) for group, values in dates.items()}
+
+
+def record_regime_events(
+    level: str,
+    rows: pd.DataFrame,
+    key_col: str,
+    regime_col: str,
+    start_date,
+    drivers: list | None = None
+) -> pd.DataFrame:
+    """
+    Detects `level`'s regime transitions from `start_date` on and writes them
+    to regime store '<level>_events', replacing that store's events from the
+    same date (recomputed dates never leave stale events).
+    Persistence = stored dates the From regime held: since the group's
+    previous event, else since its first date in store `level`.
+    """
+    name = f"{level}_events"
+
+    events = detect_regime_transitions(rows, key_col, regime_col, start_date, drivers)
+    truncate_regime_store(name, start_date)
+
+    group_dates = _regime_store_group_dates(level)
+    run_start = {group: dates[-1] for group, dates in _regime_store_group_dates(name).items()}
+
+    persistence = []
+    for date, group in zip(events["Date"].dt.strftime("%Y-%m-%d"), events["Group"]):
+        dates = group_dates.get(group, np.array([date]))
+        start = run_start.get(group, dates[0])
+        persistence.append(int(np.searchsorted(dates, date) - np.searchsorted(dates, start)))
+        run_start[group] = date
+
+    events.insert(4, "Persistence", np.array(persistence, dtype=int))
+
+    append_regime_store(name, events, "Group")
+    return events.assign(Level=level)
+
 
-    return snapshot
-    
-    
 def combine_subindustry_regimes(
     structural: str,
     flow: str
 ) -> str:
     """
     Combines structural (breadth / trend) and stock-flow (leaders / confirmers)
-    regimes into a single trusted sub-industry regime.
+    regimes into a single trusted sub-industry regime
+    (the "subindustry_combine" lookup table).
     """
+    return decode_regimes(combine_subindustry_regime_codes([structural], [flow]))[0]
 
-    # --------------------------------------------------
-    # 1️⃣ BEAR OVERRIDES (risk-first)
-    # --------------------------------------------------
-    # If either structure OR capital flow says Bear,
-    # capital is exiting → protect first
-    if structural == "Bear" or flow == "Bear":
-        return "Bear"
-
-    # --------------------------------------------------
-    # 2️⃣ CONFIRMED BULL (highest conviction)
-    # --------------------------------------------------
-    # Requires:
-    # - Broad participation
-    # - Leaders + confirmers working
-    if structural == "Bull" and flow == "Bull":
-        return "Bull"
-
-    # --------------------------------------------------
-    # 3️⃣ EARLY BULL (capital returning)
-    # --------------------------------------------------
-    # Allows early positioning when:
-    # - Structure is improving
-    # - Leaders are working
-    if structural in ["Bull", "EarlyBull"] and flow == "EarlyBull":
-        return "EarlyBull"
 
-    # --------------------------------------------------
-    # 4️⃣ NEUTRAL (default)
-    # --------------------------------------------------
-    # Choppy, rotational, or inconclusive environments
-    return "Neutral"
+def combine_subindustry_regime_codes(structural, flow) -> np.ndarray:
+    """
+    combine_subindustry_regimes over whole arrays (labels or codes) as one
+    lookup into the compiled table. Int8 codes out.
+    """
+    return lookup_regime_pairs(get_regime_rules("subindustry_combine"), structural, flow)
 
 
 def get_subindustry_regime_on_date(
@@ -3430,6 +5894,8 @@ def get_subindustry_regime_on_date(
     if df.empty or regime_col not in df.columns:
         return "Neutral"
     val = df.iloc[0][regime_col]
+    if isinstance(val, (int, np.integer)):
+        val = decode_regimes([val])[0]
     return val if isinstance(val, str) and val else "Neutral"
 
 
@@ -3532,26 +5998,8 @@ def get_trend_weight(
         else "Neutral"
     ).strip()
 
-    if industry == "Bull" and subindustry == "Bull":
-        return 0.60
-
-    if industry == "Bull" and subindustry == "EarlyBull":
-        return 0.55
-
-    if industry == "Bull" and subindustry == "Neutral":
-        return 0.50
-
-    if industry == "Neutral" and subindustry == "Bull":
-        return 0.45
-
-    if industry == "Neutral" and subindustry == "Neutral":
-        return 0.40
-
-    if industry == "Bull" and subindustry == "Bear":
-        return 0.40
-
-    # Industry Bear (any subindustry)
-    return 0.30
+    # "trend_weight" lookup table; unknown labels take its default
+    return float(lookup_regime_pairs(get_regime_rules("trend_weight"), [industry], [subindustry])[0])
 
 
 def get_regime_multipliers(
@@ -3631,8 +6079,12 @@ def apply_regime_multipliers(
 # C. export_combined_scores_to_excel
 # D. open_excel_file
 # E. run_full_ranking_pipeline
-# F. run_regime_pipeline
-# G. run_master_pipeline
+# F. shard_regime_groups
+# G. compute_subindustry_regime_shard
+# H. _run_regime_shard
+# I. run_subindustry_regime_shards
+# J. run_regime_pipeline
+# K. run_master_pipeline
 #------------------------------------------------------------------------------------
 #
 #------------------------------------Functions----------------------------------------
@@ -3786,7 +6238,7 @@ def open_excel_file(path: str):
 def run_full_ranking_pipeline(
     tickers: list[str],
     ticker_to_subindustry: dict,
-    price_data: dict,
+    price_panel: pd.DataFrame,
     asof_date: pd.Timestamp,
     industry_regime: str,
     subindustry_regimes: dict
@@ -3808,7 +6260,7 @@ def run_full_ranking_pipeline(
 
     # 4) Price Trend
     daily_pts = build_daily_stock_pts(
-        price_data=price_data,
+        price_panel=price_panel,
         asof_date=asof_date,
         ticker_to_subindustry=ticker_to_subindustry,
         fair_value_scores=fair_value_scores
@@ -3951,95 +6403,123 @@ def run_master_pipeline():
         debug_sec_writer.close()
         print("✅ Raw SEC debug workbook saved →", DEBUG_SEC_PATH)
 
-def run_regime_pipeline():
+        save_http_cassette()
+
+def shard_regime_groups(regime_groups: dict, n_shards: int) -> list[dict]:
     """
-    Runs the Market / Industry / Sub-Industry regime detection pipeline
-    and writes canonical regime history CSVs.
+    Splits `regime_groups` into at most `n_shards` sub-industry shards of
+    similar ticker counts. Deterministic: the same groups always land in the
+    same shard, and each shard keeps the original group order.
     """
+    n_shards = max(1, min(n_shards, len(regime_groups)))
 
-    import os
-    import pandas as pd
-    import numpy as np
-    from datetime import datetime, timedelta
+    sizes = {
+        name: len(set(group.get("core", [])) | set(group.get("confirmers", [])))
+        for name, group in regime_groups.items()
+    }
 
-    os.makedirs("data", exist_ok=True)
+    load = [0] * n_shards
+    assignment = {}
+    for name in sorted(regime_groups, key=lambda n: (-sizes[n], n)):
+        k = load.index(min(load))
+        assignment[name] = k
+        load[k] += sizes[name]
 
-    SUBIND_HISTORY_PATH = "data/subindustry_regime_history.csv"
-    IND_HISTORY_PATH = "data/industry_regime_history.csv"
-    STOCK_PTS_PATH = "data/stock_price_trend_history.csv"
+    return [
+        {name: group for name, group in regime_groups.items() if assignment[name] == k}
+        for k in range(n_shards)
+    ]
 
-    # --------------------------------------------------
-    # Collect all tickers
-    # --------------------------------------------------
-    all_regime_tickers = flatten_ticker_groups(REGIME_GROUPS)
 
-    print("\n=== SANITY CHECK: REGIME TICKERS ===")
-    print(f"Total regime tickers: {len(all_regime_tickers)}")
-    print("===================================\n")
+def compute_subindustry_regime_shard(
+    price_panel: pd.DataFrame,
+    regime_groups: dict,
+    ticker_to_subindustry: dict,
+    subind_index: dict,
+    last_trading_date: pd.Timestamp
+) -> dict[str, pd.DataFrame]:
+    """
+    Sub-industry regime stage for the groups in `regime_groups`: new
+    snapshots (today + backfill), rolling features, structural / stock-flow
+    classification and persistence, warmed from the regime store.
+    Returns {"history": recomputed sub-industry rows, "daily_stock_pts",
+    "stock_pts_history"}; stock rows are those mapped to these groups.
+    """
+    date_str = last_trading_date.strftime("%Y-%m-%d")
 
-    # --------------------------------------------------
-    # Fetch price data
-    # --------------------------------------------------
-    end_date = datetime.today().strftime("%Y-%m-%d")
-    start_date = (datetime.today() - timedelta(days=180)).strftime("%Y-%m-%d")
+    # Every member's prices: a ticker counts toward each group that lists it
+    members = set().union(*(
+        set(group.get("core", [])) | set(group.get("confirmers", []))
+        for group in regime_groups.values()
+    ))
+    panel = select_price_columns(as_price_panel(price_panel), members)
 
-    price_data = fetch_all_prices(
-        tickers=all_regime_tickers,
-        start_date=start_date,
-        end_date=end_date
+    if panel.empty:
+        print(f"[WARN] No prices for {len(regime_groups)} sub-industries → skipped")
+        return {"history": pd.DataFrame(), "daily_stock_pts": pd.DataFrame(), "stock_pts_history": pd.DataFrame()}
+
+    shard_tickers = {t: s for t, s in ticker_to_subindustry.items() if t in members}
+
+    stored_keys = pd.DataFrame(
+        [(date, name) for date, names in subind_index.items() for name in names],
+        columns=["Date", "SubIndustry"]
     )
 
-    if not price_data:
-        print("[ERROR] No price data fetched — aborting")
-        return
+    # --------------------------------------------------
+    # Build today snapshot (once)
+    # --------------------------------------------------
+    already_has_today = date_str in subind_index
 
-    last_trading_date = max(df.index.max() for df in price_data.values())
-    date_str = last_trading_date.strftime("%Y-%m-%d")
+    new_snapshots = []
 
-    print(f"[DEBUG] Snapshot date: {date_str}")
+    if not already_has_today:
+        snapshots = compute_subindustry_snapshots(
+            panel,
+            regime_groups,
+            dates=[date_str],
+            price_features=_cached_feature_rows(panel, last_trading_date)
+        )
 
-    # ==================================================
-    # ============ SUB-INDUSTRY PIPELINE ================
-    # ==================================================
+        if not snapshots.empty:
+            new_snapshots.append(snapshots)
 
     # --------------------------------------------------
-    # Load sub-industry history
+    # Backfill missing dates / new sub-industries in the window
     # --------------------------------------------------
-    if os.path.exists(SUBIND_HISTORY_PATH):
-        history_df = pd.read_csv(SUBIND_HISTORY_PATH)
-    else:
-        history_df = pd.DataFrame()
+    if SUBIND_BACKFILL:
+        backfill = backfill_subindustry_snapshots(
+            pd.concat([stored_keys, *new_snapshots], ignore_index=True),
+            panel,
+            regime_groups
+        )
+        if not backfill.empty:
+            new_snapshots.append(backfill)
+
+    new_snapshots = (
+        pd.concat(new_snapshots, ignore_index=True)
+        if new_snapshots else pd.DataFrame(columns=["Date", "SubIndustry"])
+    )
+    new_snapshots["Date"] = pd.to_datetime(new_snapshots["Date"])
 
     # --------------------------------------------------
-    # Build today snapshot (once)
+    # Load only the trailing month before the first new date as warm state
     # --------------------------------------------------
-    already_has_today = (
-        not history_df.empty and
-        date_str in history_df["Date"].astype(str).values
+    # Rows before `update_from` keep their stored values; rows from it on
+    # are (re)computed and written back.
+    update_from = (
+        new_snapshots["Date"].min()
+        if not new_snapshots.empty else last_trading_date + pd.Timedelta(days=1)
     )
+    warm_from = min(update_from, last_trading_date) - pd.DateOffset(months=1)
 
-    if not already_has_today:
-        snapshots = []
-
-        for subindustry_name, group in REGIME_GROUPS.items():
-            snap = compute_subindustry_snapshot(
-                date_str=date_str,
-                subindustry_name=subindustry_name,
-                subindustry_group=group,
-                price_data=price_data
-            )
-            if snap is not None:
-                snapshots.append(snap)
-
-        if snapshots:
-            history_df = pd.concat(
-                [history_df, pd.DataFrame(snapshots)],
-                ignore_index=True
-            )
+    history_df = read_regime_store("subindustry", warm_from)
+    if not history_df.empty:
+        history_df = history_df[history_df["SubIndustry"].isin(list(regime_groups))]
 
     # --------------------------------------------------
     # Canonicalize
     # --------------------------------------------------
+    history_df = encode_regime_frame(pd.concat([history_df, new_snapshots], ignore_index=True))
     history_df["Date"] = pd.to_datetime(history_df["Date"])
 
     history_df = (
@@ -4049,64 +6529,292 @@ def run_regime_pipeline():
         .reset_index(drop=True)
     )
 
+    fresh = history_df["Date"] >= update_from
+
+    # Persisted structural regime of each sub-industry before `update_from`
+    warm_persist = (
+        history_df.loc[~fresh]
+        .drop_duplicates("SubIndustry", keep="last")
+        .set_index("SubIndustry")
+        .reindex(columns=["Structural_Regime_Persist"])
+        ["Structural_Regime_Persist"]
+    )
+
     # --------------------------------------------------
-    # Rolling persistence metrics
+    # Rolling persistence metrics (new rows only, stored window as warm state)
     # --------------------------------------------------
     ROLL = 5
 
-    history_df["Pct_Above_SMA_20_5D"] = (
-        history_df.groupby("SubIndustry")["Pct_Above_SMA_20"]
-        .rolling(ROLL, min_periods=ROLL).mean()
-        .reset_index(level=0, drop=True)
-    )
+    for col, source in [
+        ("Pct_Above_SMA_20_5D", "Pct_Above_SMA_20"),
+        ("Pct_Above_SMA_50_5D", "Pct_Above_SMA_50"),
+        ("New_Low_Ratio_20D_5D", "New_Low_Ratio_20D"),
+        ("Pct_Higher_Highs_20D_5D", "Pct_Higher_Highs_20D"),
+        ("Pct_Higher_Highs_50D_5D", "Pct_Higher_Highs_50D"),
+    ]:
+        rolled = (
+            history_df.groupby("SubIndustry", observed=True)[source]
+            .rolling(ROLL, min_periods=ROLL).mean()
+            .reset_index(level=0, drop=True)
+        )
+        history_df.loc[fresh, col] = rolled[fresh]
 
-    history_df["Pct_Above_SMA_50_5D"] = (
-        history_df.groupby("SubIndustry")["Pct_Above_SMA_50"]
-        .rolling(ROLL, min_periods=ROLL).mean()
-        .reset_index(level=0, drop=True)
-    )
+    history_df.loc[fresh, "Slope_Median_Pct_From_SMA_20"] = (
+        history_df.groupby("SubIndustry", observed=True)["Median_Pct_From_SMA_20"]
+        .diff(ROLL)
+    )[fresh]
 
-    history_df["New_Low_Ratio_20D_5D"] = (
-        history_df.groupby("SubIndustry")["New_Low_Ratio_20D"]
-        .rolling(ROLL, min_periods=ROLL).mean()
-        .reset_index(level=0, drop=True)
-    )
+    # --------------------------------------------------
+    # Structural sub-industry regime (RAW)
+    # --------------------------------------------------
+    history_df.loc[fresh, "Structural_Regime"] = classify_subindustry_regimes(history_df.loc[fresh])
+
+    # --------------------------------------------------
+    # Structural persistence (KEY FIX ALREADY ADDED)
+    # --------------------------------------------------
+    history_df.loc[fresh, "Structural_Regime_Persist"] = compute_regime_persistence(
+        history_df["Structural_Regime"],
+        history_df["SubIndustry"],
+        initial=warm_persist
+    )[fresh]
 
-    history_df["Pct_Higher_Highs_20D_5D"] = (
-        history_df.groupby("SubIndustry")["Pct_Higher_Highs_20D"]
-        .rolling(ROLL, min_periods=ROLL).mean()
-        .reset_index(level=0, drop=True)
+    # --------------------------------------------------
+    # Stock-flow regime prep
+    # --------------------------------------------------
+    daily_stock_pts = build_daily_stock_pts(
+        price_panel=panel,
+        asof_date=last_trading_date,
+        ticker_to_subindustry=shard_tickers
     )
 
-    history_df["Pct_Higher_Highs_50D_5D"] = (
-        history_df.groupby("SubIndustry")["Pct_Higher_Highs_50D"]
-        .rolling(ROLL, min_periods=ROLL).mean()
-        .reset_index(level=0, drop=True)
+    # --------------------------------------------------
+    # Stock-flow regime (one flow per date from the window's PTS history)
+    # --------------------------------------------------
+    # Dates with fewer than PTS_TAIL_BARS bars before them would be scored
+    # on truncated history, so the backfill starts after that warm-up.
+    if len(panel.index) >= PTS_TAIL_BARS:
+        stock_pts_history = build_stock_pts_history(
+            price_panel=panel,
+            start_date=panel.index[PTS_TAIL_BARS - 1],
+            end_date=last_trading_date,
+            ticker_to_subindustry=shard_tickers
+        )
+    else:
+        stock_pts_history = pd.DataFrame()
+
+    flow_pts = pd.concat(
+        [stock_pts_history, daily_stock_pts],
+        ignore_index=True
+    ).drop_duplicates(["Date", "Ticker"], keep="last")
+
+    stock_flow = classify_subindustry_stock_flows(flow_pts, regime_groups)
+    stock_flow["Date"] = pd.to_datetime(stock_flow["Date"])
+
+    # Dates outside the PTS window keep the flow saved when they were current
+    flow = history_df[["Date", "SubIndustry"]].merge(
+        stock_flow,
+        on=["Date", "SubIndustry"],
+        how="left"
+    )["StockFlow_Regime"]
+    if "StockFlow_Regime" in history_df.columns:
+        flow = flow.fillna(history_df["StockFlow_Regime"])
+    flow = encode_regimes(flow)
+    flow[flow == REGIME_MISSING_CODE] = REGIME_CODES["Neutral"]
+    history_df.loc[fresh, "StockFlow_Regime"] = flow[fresh.to_numpy()]
+
+    # --------------------------------------------------
+    # FINAL sub-industry regime
+    # --------------------------------------------------
+    history_df.loc[fresh, "SubIndustry_Regime"] = combine_subindustry_regime_codes(
+        history_df.loc[fresh, "Structural_Regime_Persist"],
+        history_df.loc[fresh, "StockFlow_Regime"]
     )
 
-    history_df["Slope_Median_Pct_From_SMA_20"] = (
-        history_df.groupby("SubIndustry")["Median_Pct_From_SMA_20"]
-        .diff(ROLL)
+    # Shared tickers are scored in every shard listing them but kept by one
+    def own_rows(df):
+        if df.empty:
+            return df
+        return df[df["SubIndustry"].isin(list(regime_groups))].reset_index(drop=True)
+
+    return {
+        "history": encode_regime_frame(history_df.loc[fresh].reset_index(drop=True)),
+        "daily_stock_pts": own_rows(daily_stock_pts),
+        "stock_pts_history": own_rows(stock_pts_history),
+    }
+
+
+def _run_regime_shard(task: dict) -> str:
+    """
+    Process-pool entry point: one compute_subindustry_regime_shard over the
+    shared memory-mapped panel, each result frame written to
+    `task["out_dir"]` as a Parquet partition. Returns the directory.
+    """
+    price_panel = load_price_panel_mmap(task["panel_path"])
+
+    result = compute_subindustry_regime_shard(
+        price_panel,
+        task["regime_groups"],
+        task["ticker_to_subindustry"],
+        task["subind_index"],
+        task["last_trading_date"]
     )
 
+    os.makedirs(task["out_dir"], exist_ok=True)
+    for name, frame in result.items():
+        frame.to_parquet(os.path.join(task["out_dir"], f"{name}.parquet"), index=False)
+
+    return task["out_dir"]
+
+
+def run_subindustry_regime_shards(
+    price_panel: pd.DataFrame,
+    regime_groups: dict,
+    ticker_to_subindustry: dict,
+    subind_index: dict,
+    last_trading_date: pd.Timestamp,
+    workers: int = REGIME_SHARD_WORKERS,
+    panel_path: str = PRICE_PANEL_MMAP_PATH
+) -> dict[str, pd.DataFrame]:
+    """
+    compute_subindustry_regime_shard across a process pool, one shard of
+    sub-industries per worker. Workers map the panel at `panel_path` and
+    write per-shard partitions; they are merged in key order, so the result
+    does not depend on shard count or completion order.
+    One worker (or no fork support) runs the stage in-process.
+    """
+    shards = shard_regime_groups(regime_groups, workers)
+
+    if len(shards) <= 1 or "fork" not in multiprocessing.get_all_start_methods():
+        return compute_subindustry_regime_shard(
+            price_panel, regime_groups, ticker_to_subindustry, subind_index, last_trading_date
+        )
+
+    run_dir = os.path.join(REGIME_SHARD_DIR, last_trading_date.strftime("%Y-%m-%d"))
+    shutil.rmtree(run_dir, ignore_errors=True)
+
+    tasks = [
+        {
+            "panel_path": panel_path,
+            "regime_groups": shard,
+            "ticker_to_subindustry": ticker_to_subindustry,
+            "subind_index": subind_index,
+            "last_trading_date": last_trading_date,
+            "out_dir": os.path.join(run_dir, f"shard-{k:03d}"),
+        }
+        for k, shard in enumerate(shards)
+    ]
+
+    # fork: workers inherit the primed feature cache and skip re-running
+    # the module's import-time setup (CIK map download)
+    with ProcessPoolExecutor(
+        max_workers=len(tasks),
+        mp_context=multiprocessing.get_context("fork")
+    ) as pool:
+        out_dirs = list(pool.map(_run_regime_shard, tasks))
+
+    sort_keys = {
+        "history": ["SubIndustry", "Date"],
+        "daily_stock_pts": ["Date", "Ticker"],
+        "stock_pts_history": ["Date", "Ticker"],
+    }
+
+    merged = {}
+    for name, keys in sort_keys.items():
+        frames = [pd.read_parquet(os.path.join(d, f"{name}.parquet")) for d in out_dirs]
+        frames = [f for f in frames if not f.empty]
+        merged[name] = (
+            encode_regime_frame(pd.concat(frames, ignore_index=True))
+            .sort_values(keys)
+            .reset_index(drop=True)
+            if frames else pd.DataFrame()
+        )
+
+    shutil.rmtree(run_dir, ignore_errors=True)
+
+    print(f"[INFO] Sub-industry regime stage merged from {len(tasks)} shards")
+    return merged
+
+
+def run_regime_pipeline():
+    """
+    Runs the Market / Industry / Sub-Industry regime detection pipeline
+    and appends the new dates to the monthly Parquet regime stores
+    (data/regime_history). The full CSV histories are only rewritten when
+    EXPORT_REGIME_HISTORY_CSV is on.
+    """
+
+    import os
+    import pandas as pd
+    import numpy as np
+    from datetime import datetime, timedelta
+
+    os.makedirs("data", exist_ok=True)
+
+    SUBIND_HISTORY_PATH = "data/subindustry_regime_history.csv"
+    IND_HISTORY_PATH = "data/industry_regime_history.csv"
+    STOCK_PTS_PATH = "data/stock_price_trend_history.csv"
+
     # --------------------------------------------------
-    # Structural sub-industry regime (RAW)
+    # Collect all tickers
     # --------------------------------------------------
-    history_df["Structural_Regime"] = history_df.apply(
-        classify_subindustry_regime,
-        axis=1
-    )
+    all_regime_tickers = flatten_ticker_groups(REGIME_GROUPS)
+
+    print("\n=== SANITY CHECK: REGIME TICKERS ===")
+    print(f"Total regime tickers: {len(all_regime_tickers)}")
+    print("===================================\n")
 
     # --------------------------------------------------
-    # Structural persistence (KEY FIX ALREADY ADDED)
+    # Fetch price data
     # --------------------------------------------------
-    history_df["Structural_Regime_Persist"] = (
-        history_df
-        .groupby("SubIndustry")["Structural_Regime"]
-        .apply(lambda s: s.where(s == s.shift()).ffill())
-        .reset_index(level=0, drop=True)
+    today = pipeline_today()
+    end_date = today.strftime("%Y-%m-%d")
+    start_date = (today - timedelta(days=180)).strftime("%Y-%m-%d")
+
+    price_panel = fetch_all_prices(
+        tickers=all_regime_tickers,
+        start_date=start_date,
+        end_date=end_date
     )
 
+    if price_panel.empty:
+        print("[ERROR] No price data fetched — aborting")
+        return
+
+    # Score from the shared mapped copy (see PRICE_PANEL_MMAP_PATH)
+    save_price_panel_mmap(price_panel)
+    price_panel = load_price_panel_mmap()
+
+    last_trading_date = price_panel.index.max()
+    date_str = last_trading_date.strftime("%Y-%m-%d")
+
+    # --------------------------------------------------
+    # Streaming indicators: only bars newer than the saved state are fed
+    # --------------------------------------------------
+    indicator_states = load_indicator_states()
+    latest_indicators = advance_indicator_states(indicator_states, price_panel)
+    save_indicator_states(indicator_states)
+
+    # One feature cache per run, shared by snapshots and PTS scoring
+    reset_price_feature_cache()
+    prime_price_feature_cache(latest_indicators)
+
+    print(f"[DEBUG] Snapshot date: {date_str}")
+
+    # ==================================================
+    # ============ SUB-INDUSTRY PIPELINE ================
+    # ==================================================
+
+    # --------------------------------------------------
+    # Load sub-industry history index (one-time import of the CSV history)
+    # --------------------------------------------------
+    subind_index = load_regime_store_index("subindustry")
+
+    if not subind_index and os.path.exists(SUBIND_HISTORY_PATH):
+        append_regime_store("subindustry", pd.read_csv(SUBIND_HISTORY_PATH), "SubIndustry")
+        if os.path.exists(IND_HISTORY_PATH):
+            append_regime_store("industry", pd.read_csv(IND_HISTORY_PATH), "Industry")
+        subind_index = load_regime_store_index("subindustry")
+
     # --------------------------------------------------
     # Stock-flow regime prep
     # --------------------------------------------------
@@ -4117,11 +6825,20 @@ def run_regime_pipeline():
         for t in group.get("confirmers", []):
             ticker_to_subindustry[t] = subindustry
 
-    daily_stock_pts = build_daily_stock_pts(
-        price_data=price_data,
-        asof_date=last_trading_date,
-        ticker_to_subindustry=ticker_to_subindustry
+    # --------------------------------------------------
+    # Snapshots, rolling features, classification (sharded by sub-industry)
+    # --------------------------------------------------
+    stage = run_subindustry_regime_shards(
+        price_panel,
+        REGIME_GROUPS,
+        ticker_to_subindustry,
+        subind_index,
+        last_trading_date
     )
+
+    daily_stock_pts = stage["daily_stock_pts"]
+    stock_pts_history = stage["stock_pts_history"]
+
     # ==================================================
     # 🔧 NEW: Build canonical sub-industry snapshot features
     # ==================================================
@@ -4133,66 +6850,73 @@ def run_regime_pipeline():
     # Ensure types align with your history_df
     canonical_snap["Date"] = pd.to_datetime(canonical_snap["Date"])
 
+    # --------------------------------------------------
+    # Save sub-industry history (new / recomputed dates only)
+    # --------------------------------------------------
+    append_regime_store("subindustry", stage["history"], "SubIndustry")
+
+    if EXPORT_REGIME_HISTORY_CSV:
+        export_regime_store("subindustry", SUBIND_HISTORY_PATH, "SubIndustry")
+
+    # Rows before `update_from` kept their stored values; every shard's
+    # rows from it on are read back for the industry stage, with a month
+    # of earlier rows to seed transition detection
+    update_from = (
+        stage["history"]["Date"].min()
+        if not stage["history"].empty else last_trading_date + pd.Timedelta(days=1)
+    )
+    warm_from = min(update_from, last_trading_date) - pd.DateOffset(months=1)
+
+    history_df = read_regime_store("subindustry", warm_from)
+    if history_df.empty:
+        print("[ERROR] No sub-industry regime history — aborting")
+        return
+
+    history_df["Date"] = pd.to_datetime(history_df["Date"])
+
+    fresh = history_df["Date"] >= update_from
+
+    subindustry_events = record_regime_events(
+        "subindustry", history_df, "SubIndustry", "SubIndustry_Regime",
+        update_from, REGIME_EVENT_DRIVERS["subindustry"]
+    )
 
     # ==================================================
     # 🔧 FIX: INJECT REGIMES INTO STOCK-LEVEL TABLE
     # ==================================================
-    regime_lookup = history_df[
+    regime_lookup = decode_regime_frame(history_df[
         history_df["Date"] == last_trading_date
     ][[
         "SubIndustry",
         "SubIndustry_Regime",
         "Structural_Regime_Persist"
-    ]].drop_duplicates("SubIndustry")
+    ]].drop_duplicates("SubIndustry"))
 
-    daily_stock_pts = daily_stock_pts.merge(
+    daily_stock_pts = decode_regime_frame(daily_stock_pts).merge(
         regime_lookup,
         on="SubIndustry",
         how="left"
     )
 
-    # --------------------------------------------------
-    # Stock-flow regime
-    # --------------------------------------------------
-    history_df["StockFlow_Regime"] = history_df.apply(
-        lambda r: classify_subindustry_stock_flow(
-            subindustry_name=r["SubIndustry"],
-            daily_stock_pts=daily_stock_pts
-        ),
-        axis=1
-    )
-
-    # --------------------------------------------------
-    # FINAL sub-industry regime
-    # --------------------------------------------------
-    history_df["SubIndustry_Regime"] = history_df.apply(
-        lambda r: combine_subindustry_regimes(
-            r["Structural_Regime_Persist"],
-            r["StockFlow_Regime"]
-        ),
-        axis=1
-    )
-
-    # --------------------------------------------------
-    # Save sub-industry history
-    # --------------------------------------------------
-    history_df.to_csv(SUBIND_HISTORY_PATH, index=False)
-    print(f"[SUCCESS] Sub-industry history saved → {SUBIND_HISTORY_PATH}")
-
     # ==================================================
     # ================ INDUSTRY PIPELINE ===============
     # ==================================================
-    industry_rows = []
+    industry_df = read_regime_store("industry", warm_from)
+    if not industry_df.empty:
+        industry_df["Date"] = pd.to_datetime(industry_df["Date"])
+        industry_df = industry_df[industry_df["Date"] < update_from]
 
-    for date, _ in history_df.groupby("Date"):
-        row = compute_tech_industry_snapshot(
-            history_df=history_df,
-            date=date
-        )
-        row["Date"] = date
-        industry_rows.append(row)
+    warm_industry_persist = (
+        industry_df
+        .drop_duplicates("Industry", keep="last")
+        .set_index("Industry")["Industry_Regime_Persist"]
+        if not industry_df.empty else None
+    )
 
-    industry_df = pd.DataFrame(industry_rows)
+    industry_df = encode_regime_frame(pd.concat(
+        [industry_df, compute_industry_snapshots(history_df.loc[fresh])],
+        ignore_index=True
+    ))
 
     industry_df = (
         industry_df
@@ -4204,56 +6928,80 @@ def run_regime_pipeline():
     # --------------------------------------------------
     # Industry persistence
     # --------------------------------------------------
-    industry_df["Industry_Regime_Persist"] = (
-        industry_df
-        .groupby("Industry")["Tech_Regime"]
-        .apply(lambda s: s.where(s == s.shift()).ffill())
-        .reset_index(level=0, drop=True)
+    industry_fresh = industry_df["Date"] >= update_from
+
+    industry_df.loc[industry_fresh, "Industry_Regime_Persist"] = compute_regime_persistence(
+        industry_df["Industry_Regime"],
+        industry_df["Industry"],
+        initial=warm_industry_persist
+    )[industry_fresh]
+    encode_regime_frame(industry_df)
+
+    append_regime_store("industry", industry_df.loc[industry_fresh], "Industry")
+
+    if EXPORT_REGIME_HISTORY_CSV:
+        export_regime_store("industry", IND_HISTORY_PATH, "Industry")
+
+    industry_events = record_regime_events(
+        "industry", industry_df, "Industry", "Industry_Regime_Persist",
+        update_from, REGIME_EVENT_DRIVERS["industry"]
     )
 
-    industry_df.to_csv(IND_HISTORY_PATH, index=False)
-    print(f"[SUCCESS] Industry history saved → {IND_HISTORY_PATH}")
+    # --------------------------------------------------
+    # Regime transition events → handlers
+    # --------------------------------------------------
+    regime_events = decode_regime_frame(pd.concat(
+        [subindustry_events, industry_events], ignore_index=True
+    ))
+
+    for event in regime_events.loc[regime_events["Date"] == last_trading_date].itertuples():
+        print(
+            f"[INFO] {event.Level} {event.Group}: {event.From_Regime} → {event.To_Regime} "
+            f"after {event.Persistence} days"
+        )
+    print(f"[INFO] Regime transitions since {min(update_from, last_trading_date).date()}: {len(regime_events)}")
+
+    if not regime_events.empty:
+        for handler in REGIME_EVENT_HANDLERS:
+            handler(regime_events)
 
     # --------------------------------------------------
     # Attach industry regime to stocks
     # --------------------------------------------------
-    industry_regime_today = industry_df.loc[
-        industry_df["Date"] == last_trading_date,
-        "Industry_Regime_Persist"
-    ]
-
-    industry_regime_today = (
-        industry_regime_today.iloc[0]
-        if not industry_regime_today.empty
-        else "Neutral"
+    industry_today = decode_regime_frame(
+        industry_df.loc[industry_df["Date"] == last_trading_date]
+    )
+    industry_regimes_today = (
+        industry_today
+        .set_index("Industry")["Industry_Regime_Persist"]
+        .to_dict()
     )
 
-    daily_stock_pts["Industry_Regime"] = industry_regime_today
+    # Primary (first registered) industry, kept for single-industry callers
+    industry_regime_today = industry_regimes_today.get(next(iter(INDUSTRY_REGISTRY)), "Neutral")
+
+    daily_stock_pts["Industry_Regime"] = (
+        daily_stock_pts["SubIndustry"]
+        .map(build_subindustry_industry_map())
+        .map(industry_regimes_today)
+        .fillna("Neutral")
+    )
 
 
     # --------------------------------------------------
-    # Save daily stock PTS
+    # Save daily stock PTS (range backfill of the fetched window)
     # --------------------------------------------------
-#    if os.path.exists(STOCK_PTS_PATH):
- #       stock_hist = pd.read_csv(STOCK_PTS_PATH)
- #   else:
- #       stock_hist = pd.DataFrame()
-#
- #   if (
-  #      stock_hist.empty or
-   #     "Date" not in stock_hist.columns or
-   #     date_str not in stock_hist["Date"].astype(str).values
-   # ):
-    #    stock_hist = pd.concat([stock_hist, daily_stock_pts], ignore_index=True)
-     #   stock_hist = stock_hist.drop_duplicates(["Date", "Ticker"], keep="last")
-      #  stock_hist.to_csv(STOCK_PTS_PATH, index=False)
+    if not stock_pts_history.empty:
+        save_stock_pts_history(stock_pts_history, STOCK_PTS_PATH)
 
     print("\n=== PIPELINE COMPLETE ===")
     return {
     "daily_stock_pts": daily_stock_pts,
     "industry_regime": industry_regime_today,
+    "industry_regimes": industry_regimes_today,
+    "regime_events": regime_events,
     "subindustry_regimes": (
-        history_df.loc[history_df["Date"] == last_trading_date]
+        decode_regime_frame(history_df.loc[history_df["Date"] == last_trading_date])
         .set_index("SubIndustry")["SubIndustry_Regime"]
         .to_dict()
     ),
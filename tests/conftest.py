@@ -0,0 +1,37 @@
+import importlib
+import os
+import sys
+
+import pytest
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class _TickerResponse:
+    """
+    Stands in for the SEC company_tickers.json request made at import.
+    """
+    status_code = 200
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return {"0": {"ticker": "AAPL", "cik_str": 320193}}
+
+
+@pytest.fixture(scope="session")
+def nidata(tmp_path_factory):
+    """
+    NIDATA_CURRENT imported offline, with a scratch working directory for
+    everything it writes under data/.
+    """
+    os.chdir(tmp_path_factory.mktemp("work"))
+
+    original = requests.get
+    requests.get = lambda *args, **kwargs: _TickerResponse()
+    try:
+        return importlib.import_module("NIDATA_CURRENT")
+    finally:
+        requests.get = original
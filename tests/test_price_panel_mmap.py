@@ -0,0 +1,28 @@
+import numpy as np
+import pandas as pd
+
+
+def _panel(start, n_dates=40):
+    dates = pd.bdate_range(start, periods=n_dates)
+    values = np.arange(n_dates * 3, dtype=float).reshape(n_dates, 3) + dates.day.to_numpy()[:, None]
+    return pd.DataFrame(
+        values,
+        index=pd.DatetimeIndex(dates, name="Date"),
+        columns=pd.Index(["AAA", "BBB", "CCC"], name="Ticker"),
+    )
+
+
+def test_resaved_panel_keeps_dates_and_values_paired(nidata, tmp_path):
+    path = str(tmp_path / "price_panel.npy")
+    old, new = _panel("2026-01-05"), _panel("2026-01-12")
+
+    nidata.save_price_panel_mmap(old, path)
+    mapped_old = nidata.load_price_panel_mmap(path)
+
+    # Same shape, shifted window: only the version pairing can tell them apart
+    nidata.save_price_panel_mmap(new, path)
+    mapped_new = nidata.load_price_panel_mmap(path)
+
+    pd.testing.assert_frame_equal(mapped_old, old, check_freq=False)
+    pd.testing.assert_frame_equal(mapped_new, new, check_freq=False)
+    assert len(list(tmp_path.glob("price_panel.*.npy"))) == 1
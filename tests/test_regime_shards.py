@@ -0,0 +1,32 @@
+import numpy as np
+import pandas as pd
+
+
+def _panel(tickers, n_dates=60):
+    rng = np.random.default_rng(0)
+    values = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, (n_dates, len(tickers))), axis=0))
+    return pd.DataFrame(
+        np.asfortranarray(values),
+        index=pd.DatetimeIndex(pd.bdate_range("2026-01-05", periods=n_dates), name="Date"),
+        columns=pd.Index(tickers, name="Ticker"),
+    )
+
+
+def test_select_price_columns_copies_no_prices(nidata):
+    panel = _panel(["AAA", "BBB", "CCC"])
+
+    selected = nidata.select_price_columns(panel, ["CCC", "AAA", "ZZZ"])
+
+    assert list(selected.columns) == ["AAA", "CCC"]
+    for ticker in selected.columns:
+        assert np.shares_memory(selected[ticker].to_numpy(), panel.to_numpy())
+
+
+def test_shard_without_prices_is_skipped(nidata):
+    panel = _panel(["AAA", "BBB", "CCC"])
+    groups = {"Ghost": {"core": ["ZZZ1", "ZZZ2", "ZZZ3"], "confirmers": []}}
+
+    assert nidata.compute_subindustry_snapshots(panel.iloc[:, :0], groups).empty
+
+    stage = nidata.compute_subindustry_regime_shard(panel, groups, {}, {}, panel.index[-1])
+    assert all(frame.empty for frame in stage.values())
@@ -0,0 +1,17 @@
+import pandas as pd
+
+
+def test_stock_flows_without_rows_are_empty(nidata):
+    no_rows = pd.DataFrame(columns=["Date", "Ticker", "PTS"])
+
+    for stock_pts in (no_rows, pd.DataFrame()):
+        flows = nidata.classify_subindustry_stock_flows(stock_pts)
+        assert flows.empty
+        assert list(flows.columns) == ["Date", "SubIndustry", "StockFlow_Regime"]
+
+
+def test_single_stock_flow_without_rows_is_neutral(nidata):
+    name = next(iter(nidata.REGIME_GROUPS))
+
+    assert nidata.classify_subindustry_stock_flow(name, pd.DataFrame(columns=["Date", "Ticker", "PTS"])) == "Neutral"
+    assert nidata.classify_subindustry_stock_flow(name, pd.DataFrame()) == "Neutral"